@@ -1,2 +1,16 @@
 from .gretaparse import *
+from .parsecache import *
+from .limcheck import *
+from .tdbmeta import *
+from .limlog import *
+from .gretatime import *
+from .limhistory import *
+from .glimmondiff import *
+from .fetchplan import *
+from .profiling import *
+from .glimmonbin import *
+from .derived import *
+from .eventstore import *
+from .decimate import *
+from .decwatch import *
 from .version import __version__
\ No newline at end of file
@@ -0,0 +1,394 @@
+""" Benchmarks for the GRETA file parsers using synthetic input files.
+
+The generate_* functions write realistic synthetic GRETA files of a configurable size: limit
+monitoring specifications (G_LIMMON.dec) with a comment history section, limit files written by
+G_LIMMON including corrupted rows with a missing value, and dec plot files. The run_benchmarks
+function generates a set of these files and times read_glimmon, parse_comments,
+process_limits_file and parse_decplot on them, recording throughput and peak memory.
+
+The benchmarks can also be run from the command line:
+
+    python -m gretafun.benchmark --scale 10 --repeat 3
+
+All generators are deterministic for a given seed, so results from different machines or
+revisions of this package can be compared directly.
+
+"""
+
+import calendar
+import gc
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from .gretaparse import read_glimmon, parse_comments, process_limits_file, parse_decplot
+from .tdbmeta import TableMetadata
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2, peak memory is taken from the resident set size of the process instead
+    tracemalloc = None
+    import resource
+
+__all__ = ['generate_glimmon', 'generate_limfile', 'generate_decplot', 'run_benchmarks']
+
+# Names used to build synthetic mnemonics, states and people
+_msid_prefixes = ('TEPHIN', '4RT', 'AACCCD', 'PM', 'TCYL', 'OOBTHR', 'ELBV', '1DEAMZT')
+_states = ('NPNT', 'NMAN', 'NSUN', 'STBY', 'ENAB', 'DISA', 'ON', 'OFF')
+_names = ('Jane Smith', 'John Doe', 'Maria Garcia', 'Wei Chen', 'Sam Jones')
+_limit_types = ('Caution Low', 'Caution High', 'Warning Low', 'Warning High')
+_colors = ('RED', 'BLUE', 'GREEN', 'YELLOW', 'WHITE', 'CYAN', 'MAGENTA')
+
+
+def _msid_names(nmsids):
+    return ['{}{:04d}'.format(_msid_prefixes[n % len(_msid_prefixes)], n) for n in range(nmsids)]
+
+
+def _state_msid_names(nmsids):
+    return ['AO{:04d}ST'.format(n) for n in range(nmsids)]
+
+
+def generate_glimmon(filename, nmsids=1000, nsets=2, ncomments=200, seed=0):
+    """ Write a synthetic GRETA limit monitoring specification (G_LIMMON.dec) file.
+
+    :param filename: Output file name
+    :param nmsids: Number of mnemonics, one in four is an expected state mnemonic
+    :param nsets: Number of limit sets for each limit mnemonic, the first is the default and
+                  the others are selected by the state of a switch mnemonic
+    :param ncomments: Number of revision entries in the comment history section, which starts
+                      at the first line of the file (use startline=0 with parse_comments)
+    :param seed: Random number generator seed
+
+    :returns: Number of lines written
+
+    """
+
+    rng = random.Random(seed)
+    nstates = nmsids // 4
+    limitmsids = _msid_names(nmsids - nstates)
+    statemsids = _state_msid_names(nstates)
+
+    lines = []
+
+    # Comment history, oldest entries first
+    for n in range(ncomments):
+        year = 2001 + (n * 13) // max(ncomments, 1)
+        date = '{:02d}-{:02d}-{}'.format(rng.randint(1, 12), rng.randint(1, 28), year)
+        lines.append('#   {}  {} Updated limits for revision {}, following the thermal'
+                     .format(date, rng.choice(_names), n))
+        lines.append('#   review of the previous month.')
+        lines.append('#')
+        lines.append('#                  From                      To                      '
+                     'Description')
+        for _ in range(rng.randint(1, 4)):
+            limittype = rng.choice(_limit_types)
+            old = rng.uniform(0, 150)
+            lines.append('#         {:<10s} {}= {:.1f}  {}= {:.1f}  Adjusted for new attitude'
+                         .format(rng.choice(limitmsids), limittype, old, limittype,
+                                 old + rng.uniform(-5, 5)))
+        lines.append('#')
+    lines.append('#' + '=' * 75)
+
+    lines.append('#$Revision: 2.{} $'.format(ncomments))
+    lines.append('XMSID TEXTONLY ROWCOL 1 1 COLOR GREEN  "Version : $ 2014:100 $"')
+    lines.append('XMSID TEXTONLY ROWCOL 1 1 COLOR GREEN  "Database : P011"')
+    lines.append('MLMDEFTOL 1')
+    lines.append('MLMTHROW 0')
+
+    for msid in statemsids:
+        lines.append('MLOAD {}'.format(msid))
+        lines.append('MLIMIT SET 0 DEFAULT EXPST {}'.format(rng.choice(_states)))
+        lines.append('MLMTOL {}'.format(rng.randint(1, 5)))
+
+    for n, msid in enumerate(limitmsids):
+        lines.append('MLOAD {}'.format(msid))
+        if nsets > 1 and statemsids:
+            lines.append('MLIMSW {}'.format(statemsids[n % len(statemsids)]))
+        for setnum in range(nsets):
+            center = rng.uniform(-50, 150)
+            width = rng.uniform(5, 50)
+            limits = (center - 2 * width, center - width, center + width, center + 2 * width)
+            default = ' DEFAULT' if setnum == 0 else ''
+            switch = ' SWITCHSTATE {}'.format(_states[setnum % len(_states)]) if nsets > 1 else ''
+            lines.append('MLIMIT SET {}{}{} PPENG {:.2f} {:.2f} {:.2f} {:.2f}'
+                         .format(setnum, default, switch, *limits))
+        if rng.random() < 0.2:
+            lines.append('MLMTOL {}'.format(rng.randint(1, 5)))
+        if rng.random() < 0.1:
+            lines.append('MLMENABLE {}'.format(rng.randint(0, 1)))
+
+    with open(filename, 'w') as fid:
+        fid.write('\n'.join(lines) + '\n')
+
+    return len(lines)
+
+
+def _greta_time(secs, year=2014):
+    """ Return a GRETA format time for a number of seconds after the start of a year.
+    """
+    msec = int(round(secs * 1000))
+    day, msec = divmod(msec, 86400000)
+    while day >= 365 + calendar.isleap(year):
+        day -= 365 + calendar.isleap(year)
+        year += 1
+    hour, msec = divmod(msec, 3600000)
+    minute, msec = divmod(msec, 60000)
+    return '{}{:03d}.{:02d}{:02d}{:05d}'.format(year, day + 1, hour, minute, msec)
+
+
+def generate_limfile(filename, nlines=1000000, nmsids=200, corrupt=0.001, seed=0):
+    """ Write a synthetic limit file, as written by G_LIMMON.
+
+    :param filename: Output file name
+    :param nlines: Number of lines
+    :param nmsids: Number of mnemonics, one in four is an expected state mnemonic
+    :param corrupt: Fraction of violations written with a missing current value (6 columns)
+    :param seed: Random number generator seed
+
+    :returns: Number of lines written
+
+    Each mnemonic alternates between violations (CAUTION and WARNING for limit mnemonics,
+    OUT-OF-STATE for expected state mnemonics) and returns to NOMINAL, one line per second.
+
+    """
+
+    rng = random.Random(seed)
+    nstates = nmsids // 4
+    msids = [(msid, False) for msid in _msid_names(nmsids - nstates)]
+    msids.extend((msid, True) for msid in _state_msid_names(nstates))
+    violating = dict((msid, False) for msid, state in msids)
+
+    with open(filename, 'w') as fid:
+        lines = []
+        for n in range(nlines):
+            msid, state = msids[rng.randrange(len(msids))]
+            tstring = _greta_time(n)
+
+            if violating[msid] and rng.random() < 0.3:
+                violating[msid] = False
+                value = rng.choice(_states[:2]) if state else '{:.1f}'.format(rng.uniform(60, 90))
+                lines.append('{} X {} NOMINAL {}\n'.format(tstring, msid, value))
+
+            else:
+                violating[msid] = True
+                if state:
+                    msg, value, opr, lim = ('OUT-OF-STATE', rng.choice(_states[2:]), '!=',
+                                            _states[0])
+                elif rng.random() < 0.5:
+                    high = rng.random() < 0.5
+                    msg = 'WARNING-HIGH' if high else 'WARNING-LOW'
+                    value, opr, lim = ((rng.uniform(110, 130), '>', 110.0) if high else
+                                       (rng.uniform(0, 40), '<', 40.0))
+                else:
+                    high = rng.random() < 0.5
+                    msg = 'CAUTION-HIGH' if high else 'CAUTION-LOW'
+                    value, opr, lim = ((rng.uniform(100, 110), '>', 100.0) if high else
+                                       (rng.uniform(40, 50), '<', 50.0))
+
+                if rng.random() < corrupt:
+                    lines.append('{} X {} {} {} {}\n'.format(tstring, msid, msg, opr, lim))
+                elif state:
+                    lines.append('{} X {} {} {} {} {}\n'.format(tstring, msid, msg, value, opr,
+                                                                lim))
+                else:
+                    lines.append('{} X {} {} {:.1f} {} {:.1f}\n'.format(tstring, msid, msg,
+                                                                        value, opr, lim))
+
+            if len(lines) >= 10000:
+                fid.writelines(lines)
+                lines = []
+
+        fid.writelines(lines)
+
+    return nlines
+
+
+def generate_decplot(filename, nplots=20, ntraces=6, nbilevels=3, seed=0):
+    """ Write a synthetic GRETA dec plot file.
+
+    :param filename: Output file name
+    :param nplots: Number of plots (PINDEX sections)
+    :param ntraces: Number of traces (TINDEX sections) per plot
+    :param nbilevels: Number of bilevel traces (TBLINDEX sections) per plot
+    :param seed: Random number generator seed
+
+    :returns: Number of lines written
+
+    """
+
+    rng = random.Random(seed)
+    msids = _msid_names(nplots * ntraces)
+    statemsids = _state_msid_names(nplots * nbilevels)
+
+    lines = ['DTITLE  Synthetic Display',
+             'DSUBTITLE  generated by gretafun.benchmark',
+             'DTYPE  PLOT {}'.format(nplots),
+             'DXAXIS -{} 0'.format(rng.choice((60, 1440, 10080)))]
+
+    for plot in range(1, nplots + 1):
+        lines.extend(['PINDEX {}'.format(plot),
+                      'PTRACES {}'.format(ntraces),
+                      'PBILEVELS {}'.format(nbilevels),
+                      'PTITLE  Plot {}'.format(plot),
+                      'PYLABEL  degF',
+                      'PGRID 1',
+                      'PLEGEND 1',
+                      'PYAXIS {} {}'.format(rng.randint(-50, 0), rng.randint(50, 200)),
+                      'PYAUTO {}'.format(rng.randint(0, 1))])
+        for trace in range(1, ntraces + 1):
+            msid = msids[(plot - 1) * ntraces + trace - 1]
+            lines.extend(['TINDEX {}'.format(trace),
+                          'TMSID {}'.format(msid),
+                          'TNAME {}'.format(msid.lower()),
+                          'TCOLOR {}'.format(rng.choice(_colors)),
+                          'TCALC  NONE',
+                          'TSTAT 1'])
+        for bilevel in range(1, nbilevels + 1):
+            msid = statemsids[(plot - 1) * nbilevels + bilevel - 1]
+            lines.extend(['TBLINDEX {}'.format(bilevel),
+                          'TMSID {}'.format(msid),
+                          'TNAME {}'.format(msid.lower()),
+                          'TCOLOR {}'.format(rng.choice(_colors))])
+
+    with open(filename, 'w') as fid:
+        fid.write('\n'.join(lines) + '\n')
+
+    return len(lines)
+
+
+def _measure(func, args, kwargs, repeat):
+    """ Return the best time and the peak memory in bytes of repeated calls to a function.
+
+    With tracemalloc (Python 3) the peak memory is the largest amount allocated during a
+    single call. Otherwise it is the peak resident set size of the process, which includes
+    memory used before the benchmark was run. Anything the function prints (such as the
+    skipped line messages of process_limits_file) is discarded.
+    """
+
+    best = None
+    peak = 0
+    for _ in range(repeat):
+        gc.collect()
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        if tracemalloc is not None:
+            tracemalloc.start()
+        try:
+            start = time.time()
+            func(*args, **kwargs)
+            elapsed = time.time() - start
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        if tracemalloc is not None:
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        else:
+            peak = max(peak, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, peak
+
+
+def run_benchmarks(directory=None, scale=1.0, repeat=3, seed=0, verbose=True):
+    """ Generate synthetic GRETA files and time the parsers on them.
+
+    :param directory: Directory for the generated files, defaults to a temporary directory that
+                      is removed afterwards
+    :param scale: Size of the generated files relative to the defaults (a 2000 mnemonic
+                  specification with 200 comment entries, a 100000 line limit file, and a
+                  dec plot file with 50 plots)
+    :param repeat: Number of times each parser is run, the fastest time is reported
+    :param seed: Random number generator seed
+    :param verbose: If True, print a table of results
+
+    :returns: List of dictionaries with 'name', 'seconds', 'lines', 'bytes', 'lines_per_sec',
+              'mb_per_sec', and 'peak_memory' (bytes) keys, one per benchmark. Benchmarks that
+              can not run in this environment (parse_comments requires Chandra.Time) have
+              an 'error' key instead of timings.
+
+    Mnemonic metadata lookups are excluded from the process_limits_file timing by using an
+    empty metadata table.
+
+    """
+
+    tmpdir = directory is None
+    if tmpdir:
+        directory = tempfile.mkdtemp(prefix='gretafun_benchmark_')
+
+    glimmon = os.path.join(directory, 'G_LIMMON.dec')
+    limfile = os.path.join(directory, 'limfile.txt')
+    decplot = os.path.join(directory, 'plot.dec')
+
+    try:
+        glimmonlines = generate_glimmon(glimmon, nmsids=max(int(2000 * scale), 4),
+                                        ncomments=max(int(200 * scale), 1), seed=seed)
+        limlines = generate_limfile(limfile, nlines=max(int(100000 * scale), 1), seed=seed)
+        declines = generate_decplot(decplot, nplots=max(int(50 * scale), 1), seed=seed)
+
+        benchmarks = [('read_glimmon', read_glimmon, (glimmon,), {}, glimmon, glimmonlines),
+                      ('parse_comments', parse_comments, (glimmon, 0), {}, glimmon,
+                       glimmonlines),
+                      ('process_limits_file', process_limits_file, (limfile,),
+                       {'metadata': TableMetadata({})}, limfile, limlines),
+                      ('parse_decplot', parse_decplot, (decplot,), {}, decplot, declines)]
+
+        results = []
+        for name, func, args, kwargs, filename, nlines in benchmarks:
+            nbytes = os.path.getsize(filename)
+            try:
+                seconds, peak = _measure(func, args, kwargs, repeat)
+            except ImportError as err:
+                results.append({'name': name, 'lines': nlines, 'bytes': nbytes,
+                                'error': str(err)})
+                continue
+            results.append({'name': name,
+                            'seconds': seconds,
+                            'lines': nlines,
+                            'bytes': nbytes,
+                            'lines_per_sec': nlines / seconds if seconds else float('inf'),
+                            'mb_per_sec': nbytes / 1e6 / seconds if seconds else float('inf'),
+                            'peak_memory': peak})
+
+    finally:
+        if tmpdir:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    if verbose:
+        print('{:<20s} {:>10s} {:>10s} {:>12s} {:>10s} {:>12s}'.format(
+            'benchmark', 'lines', 'seconds', 'lines/s', 'MB/s', 'peak MB'))
+        for result in results:
+            if 'error' in result:
+                print('{:<20s} {:>10d}  skipped: {}'.format(result['name'], result['lines'],
+                                                           result['error']))
+                continue
+            print('{:<20s} {:>10d} {:>10.3f} {:>12.0f} {:>10.2f} {:>12.1f}'.format(
+                result['name'], result['lines'], result['seconds'], result['lines_per_sec'],
+                result['mb_per_sec'], result['peak_memory'] / 1e6))
+
+    return results
+
+
+def main(args=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark the gretafun parsers on '
+                                                 'synthetic GRETA files')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='Size of the generated files relative to the defaults')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of runs of each parser, the fastest is reported')
+    parser.add_argument('--seed', type=int, default=0, help='Random number generator seed')
+    parser.add_argument('--directory', default=None,
+                        help='Directory in which to keep the generated files')
+    opt = parser.parse_args(args)
+
+    run_benchmarks(directory=opt.directory, scale=opt.scale, repeat=opt.repeat, seed=opt.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+""" Reduce telemetry to what can be drawn when rendering GRETA dec plot displays.
+
+A display covering months of telemetry can have millions of samples per trace, far more than
+the plot has pixels. For each pixel column, the shape of a line plot is determined by the
+first, minimum, maximum, and last samples in that column, so minmax_decimate keeps only those
+samples (at most four per pixel) and the rendered plot is the same as if every sample were
+drawn. Bilevel (TBLINDEX) traces are drawn as steps, so step_transitions keeps the samples
+where the state changes, reduced in the same way when a pixel column holds more than a few
+transitions, so every step edge that can be seen is kept.
+
+The DisplayData class applies these to every trace of a parsed dec plot display (see
+gretaparse.parse_decplot). Each trace is reduced once into a set of levels with bins of 2**k
+seconds aligned to a fixed time grid, each built from the next finer level rather than the raw
+telemetry. A rendering request uses the coarsest level with bins no wider than a quarter of a
+pixel and assigns whole bins to pixel columns, so no minimum or maximum is lost and zooming
+and panning only reduce a few points per pixel. Time ranges short enough that the finest level
+would not help are reduced from the telemetry directly.
+
+"""
+
+import threading
+
+import numpy as np
+
+from .fetchplan import trace_msids
+from .gretatime import as_secs
+
+__all__ = ['minmax_decimate', 'step_transitions', 'DisplayData']
+
+# Range of level bin sizes, as powers of two seconds
+_min_level = -4
+_max_level = 40
+
+
+def _codes(vals):
+    """ Return values that can be compared with fmin and fmax, e.g. integer codes for states.
+    """
+    if vals.dtype.kind in 'iuf':
+        return vals
+    if vals.dtype.kind == 'b':
+        return vals.astype(np.int8)
+    return np.unique(vals, return_inverse=True)[1]
+
+
+def _reduce(bins, codes):
+    """ Return the indices of the first, minimum, maximum, and last samples in each bin.
+
+    :param bins: Non-decreasing integer bin number of each sample
+    :param codes: Numeric value of each sample, NaN values are ignored for the minimum and
+                  maximum
+
+    """
+
+    n = len(bins)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    starts = np.flatnonzero(np.concatenate(([True], bins[1:] != bins[:-1])))
+    if len(starts) == n:
+        return np.arange(n)
+    ends = np.concatenate((starts[1:], [n])) - 1
+    segment = np.repeat(np.arange(len(starts)), np.diff(np.concatenate((starts, [n]))))
+
+    keep = np.zeros(n, dtype=bool)
+    keep[starts] = True
+    keep[ends] = True
+    for extreme in (np.fmin, np.fmax):
+        values = extreme.reduceat(codes, starts)
+        hits = np.flatnonzero(codes == values[segment])
+        first = np.concatenate(([True], segment[hits][1:] != segment[hits][:-1]))
+        keep[hits[first]] = True
+
+    return np.flatnonzero(keep)
+
+
+def _transitions(vals):
+    """ Return the indices of the first sample, each change of state, and the last sample.
+    """
+    n = len(vals)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    changes = np.flatnonzero(vals[1:] != vals[:-1]) + 1
+    return np.unique(np.concatenate(([0], changes, [n - 1])))
+
+
+def _pixels(times, tstart, tstop, width):
+    pixel = (tstop - tstart) / float(width)
+    bins = np.floor((times - tstart) / pixel).astype(np.int64)
+    return np.clip(bins, 0, width - 1)
+
+
+def _window(times, tstart, tstop):
+    tstart = times[0] if tstart is None else as_secs(tstart)
+    tstop = times[-1] if tstop is None else as_secs(tstop)
+    return tstart, tstop
+
+
+def minmax_decimate(times, vals, width, tstart=None, tstop=None):
+    """ Reduce a trace to the first, minimum, maximum, and last samples in each pixel column.
+
+    :param times: Sorted array of sample times in seconds
+    :param vals: Array of sample values, state values are ordered alphabetically
+    :param width: Number of pixel columns
+    :param tstart: Start of the plotted time range, in seconds or any format accepted by
+                   DateTime, defaults to the first sample
+    :param tstop: End of the plotted time range, defaults to the last sample
+
+    :returns: Tuple of (times, vals) arrays holding at most 4 * width samples, in time order
+
+    """
+
+    times = np.asarray(times, dtype=np.float64)
+    vals = np.asarray(vals)
+    if len(times) == 0:
+        return times, vals
+
+    tstart, tstop = _window(times, tstart, tstop)
+    i0 = np.searchsorted(times, tstart, side='left')
+    i1 = np.searchsorted(times, tstop, side='right')
+    times, vals = times[i0:i1], vals[i0:i1]
+    if tstop <= tstart:
+        return times, vals
+
+    keep = _reduce(_pixels(times, tstart, tstop, width), _codes(vals))
+    return times[keep], vals[keep]
+
+
+def step_transitions(times, vals, width=None, tstart=None, tstop=None):
+    """ Reduce a bilevel trace to the samples needed to draw it as steps.
+
+    :param times: Sorted array of sample times in seconds
+    :param vals: Array of sample values (numbers or state names)
+    :param width: Number of pixel columns, if given, pixel columns with more than four state
+                  changes keep the first, last, lowest, and highest state changes
+    :param tstart: Start of the plotted time range, in seconds or any format accepted by
+                   DateTime, defaults to the first sample
+    :param tstop: End of the plotted time range, defaults to the last sample
+
+    :returns: Tuple of (times, vals) arrays with the state at tstart (from the last sample at or
+              before tstart), each change of state, and the last sample before tstop
+
+    """
+
+    times = np.asarray(times, dtype=np.float64)
+    vals = np.asarray(vals)
+    if len(times) == 0:
+        return times, vals
+
+    tstart, tstop = _window(times, tstart, tstop)
+    i0 = max(np.searchsorted(times, tstart, side='right') - 1, 0)
+    i1 = np.searchsorted(times, tstop, side='right')
+    times, vals = times[i0:i1], vals[i0:i1]
+
+    keep = _transitions(vals)
+    times, vals = times[keep], vals[keep]
+    if width is None or tstop <= tstart:
+        return times, vals
+
+    keep = _reduce(_pixels(times, tstart, tstop, width), _codes(vals))
+    return times[keep], vals[keep]
+
+
+class _Levels(object):
+    """ Multi-resolution reductions of one trace.
+
+    The base arrays hold every sample of an analog trace, or the state changes of a bilevel
+    trace. Level k holds the first, minimum, maximum, and last samples of each 2**k second bin,
+    as indices into the base arrays. The finest level has bins of about eight samples and is
+    built from the base arrays, each coarser level is built from the next finer one.
+
+    """
+
+    def __init__(self, times, vals, step):
+        times = np.asarray(times, dtype=np.float64)
+        vals = np.asarray(vals)
+        if step:
+            keep = _transitions(vals)
+            times, vals = times[keep], vals[keep]
+
+        self.step = step
+        self.times = times
+        self.vals = vals
+        self.codes = _codes(vals)
+
+        spacing = np.median(np.diff(times)) if len(times) > 1 else 1.0
+        base = int(np.ceil(np.log2(max(8 * spacing, 2.0 ** _min_level))))
+        self.base = min(base, _max_level)
+        self.levels = {}
+        self._lock = threading.Lock()
+
+    def level(self, k):
+        """ Return (indices, times) of level k, building it and any finer levels needed.
+        """
+        with self._lock:
+            for j in range(self.base, k + 1):
+                if j not in self.levels:
+                    if j == self.base:
+                        source = np.arange(len(self.times))
+                    else:
+                        source = self.levels[j - 1][0]
+                    bins = np.floor(self.times[source] / 2.0 ** j).astype(np.int64)
+                    keep = source[_reduce(bins, self.codes[source])]
+                    self.levels[j] = (keep, self.times[keep])
+            return self.levels[k]
+
+    def render(self, tstart, tstop, width):
+        if len(self.times) == 0 or tstop <= tstart:
+            return self.times[:0], self.vals[:0]
+
+        pixel = (tstop - tstart) / float(width)
+        k = min(int(np.floor(np.log2(pixel / 4.0))), _max_level)
+        if k < self.base:
+            # Short time ranges are reduced from the base arrays directly
+            index, times = None, self.times
+        else:
+            index, times = self.level(k)
+
+        i0 = np.searchsorted(times, tstart, side='left')
+        i1 = np.searchsorted(times, tstop, side='right')
+        if self.step and i0 > 0 and (i0 == len(times) or times[i0] > tstart):
+            # Include the state at tstart
+            i0 -= 1
+        index = np.arange(i0, i1) if index is None else index[i0:i1]
+        times = times[i0:i1]
+
+        if k >= self.base:
+            # Assign whole level bins to pixel columns, so the extremes of every bin are kept
+            # and each pixel column edge moves by at most a quarter of a pixel
+            times = np.floor(times / 2.0 ** k) * 2.0 ** k
+        keep = index[_reduce(_pixels(times, tstart, tstop, width), self.codes[index])]
+        return self.times[keep], self.vals[keep]
+
+
+class DisplayData(object):
+    """ Decimated telemetry for rendering a dec plot display at any zoom and pan.
+
+    :param decplots: Output of parse_decplot for one display
+    :param telemetry: Telemetry for the display, either the output of FetchPlan.fetch for a
+                      single display (dictionary of plot number to 'traces' and 'tbtraces'
+                      dictionaries of (times, vals) tuples), or a mapping of mnemonic name to
+                      a (times, vals) tuple or an object with "times" and "vals" attributes
+                      (e.g. a fetch_eng.MSIDset)
+    :param width: Default number of pixel columns of each plot
+
+    Example:
+
+        display = parse_decplot('/home/greta/AXAFSHARE/dec/thermal.dec')
+        data = DisplayData(display, FetchPlan(display, stop='2014:205').fetch(), width=1200)
+        times, vals = data.render()[1]['traces'][1]
+        zoomed = data.render('2014:204:00:00:00', '2014:204:06:00:00')
+
+    Traces (TINDEX) are reduced with minmax_decimate and bilevel traces (TBLINDEX) with
+    step_transitions. Each trace is reduced the first time it is rendered, later renders of
+    any time range and width reuse the reduced levels. Traces with the same mnemonic share
+    their reductions when telemetry is given by mnemonic.
+
+    """
+
+    def __init__(self, decplots, telemetry, width=1000):
+        self.decplots = decplots
+        self.width = width
+        self._telemetry = telemetry
+        self._by_plot = bool(telemetry) and all(isinstance(value, dict) and 'traces' in value
+                                                for value in telemetry.values())
+        self._traces = list(trace_msids(decplots))
+        self._levels = {}
+        self._lock = threading.Lock()
+
+    def _series(self, num, kind, tnum, msid):
+        if self._by_plot:
+            return self._telemetry.get(num, {}).get(kind, {}).get(tnum)
+        item = self._telemetry.get(msid)
+        if item is not None and not isinstance(item, tuple):
+            item = (item.times, item.vals)
+        return item
+
+    def _trace_levels(self, num, kind, tnum, msid):
+        step = kind == 'tbtraces'
+        key = (step, num, tnum) if self._by_plot else (step, msid)
+        with self._lock:
+            if key in self._levels:
+                return self._levels[key]
+
+        series = self._series(num, kind, tnum, msid)
+        levels = _Levels(series[0], series[1], step) if series is not None else None
+        with self._lock:
+            return self._levels.setdefault(key, levels)
+
+    def time_range(self):
+        """ Return the (start, stop) times in seconds spanned by the telemetry of all traces.
+        """
+        starts, stops = [], []
+        for trace in self._traces:
+            levels = self._trace_levels(*trace)
+            if levels is not None and len(levels.times):
+                starts.append(levels.times[0])
+                stops.append(levels.times[-1])
+        return (min(starts), max(stops)) if starts else (None, None)
+
+    def render(self, tstart=None, tstop=None, width=None):
+        """ Return the samples to draw for every trace over a time range.
+
+        :param tstart: Start of the time range, in seconds or any format accepted by DateTime,
+                       defaults to the start of the telemetry
+        :param tstop: End of the time range, defaults to the end of the telemetry
+        :param width: Number of pixel columns, defaults to the width given when created
+
+        :returns: Dictionary keyed by plot number, each with 'traces' and 'tbtraces'
+                  dictionaries of (times, vals) tuples keyed by trace number, in the same
+                  format as FetchPlan.fetch. Traces without telemetry are omitted.
+
+        """
+
+        width = width or self.width
+        first = last = None
+        if tstart is None or tstop is None:
+            first, last = self.time_range()
+        tstart = first if tstart is None else as_secs(tstart)
+        tstop = last if tstop is None else as_secs(tstop)
+
+        out = {}
+        for num, kind, tnum, msid in self._traces:
+            plot = out.setdefault(num, {'traces': {}, 'tbtraces': {}})
+            levels = self._trace_levels(num, kind, tnum, msid)
+            if levels is None:
+                continue
+            if tstart is None or tstop is None:
+                # No trace has any telemetry
+                plot[kind][tnum] = (levels.times, levels.vals)
+                continue
+            plot[kind][tnum] = levels.render(tstart, tstop, width)
+
+        return out
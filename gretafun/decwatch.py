@@ -0,0 +1,255 @@
+""" Keep parsed GRETA dec directory specifications up to date in a long running process.
+
+The DecWatcher class polls a dec directory for added, modified, and removed files, and parses
+only the files that changed: read_glimmon and parse_comments for limit monitoring
+specifications (G_LIMMON*.dec), and parse_decplot for everything else. Parsed results are held
+in an immutable DecSnapshot, which is replaced in a single assignment once every changed file
+has been parsed, so readers never wait for a parse and always see a consistent set of files.
+
+A file is only parsed once its modification time is at least "settle" seconds old, so a file
+that is still being written is picked up on a later poll. If a changed file fails to parse
+(for example a half written file that was copied in place), the previous result of that parser
+for that file is kept until a later version parses.
+
+"""
+
+import fnmatch
+import glob
+import os
+import threading
+import time
+
+from .gretaparse import read_glimmon, parse_comments, parse_decplot
+
+__all__ = ['DecSnapshot', 'DecWatcher']
+
+
+class DecSnapshot(object):
+    """ Parsed contents of a dec directory at one point in time.
+
+    :param version: Number of times the snapshot has changed since the watcher was created
+    :param glimmon: Dictionary of read_glimmon output keyed by file name
+    :param comments: Dictionary of parse_comments output keyed by file name
+    :param decplots: Dictionary of parse_decplot output keyed by file name
+
+    Snapshots are shared by all readers and must be treated as read-only.
+
+    """
+
+    def __init__(self, version=0, glimmon=None, comments=None, decplots=None):
+        self.version = version
+        self.glimmon = glimmon if glimmon is not None else {}
+        self.comments = comments if comments is not None else {}
+        self.decplots = decplots if decplots is not None else {}
+
+
+class DecWatcher(object):
+    """ Watch a GRETA dec directory and reparse the files that change.
+
+    :param directory: Directory containing GRETA dec files
+    :param pattern: Glob pattern used to select files within the directory
+    :param glimmon_pattern: Pattern of the file names parsed as limit monitoring
+                            specifications, other files are parsed as dec plot files
+    :param interval: Seconds between polls when running in the background
+    :param settle: Minimum age in seconds of a file modification before it is parsed
+
+    The directory is parsed when the watcher is created. After that, check() polls for changes
+    once, and start() polls every interval seconds in a background thread until stop() is
+    called. Callbacks registered with subscribe() are called with a dictionary of the changes
+    after any file is added, modified, removed, or fails to parse. The new snapshot (if any)
+    is published before callbacks are called.
+
+    Example:
+
+        watcher = DecWatcher('/home/greta/AXAFSHARE/dec')
+        watcher.subscribe(lambda changes: print(changes['modified']))
+        watcher.start()
+
+        glimmon = watcher.snapshot.glimmon['/home/greta/AXAFSHARE/dec/G_LIMMON.dec']
+
+    Each parser's result is kept separately, so the read_glimmon result of a G_LIMMON file is
+    published even if parse_comments fails for it. Files that are not plot definitions (e.g.
+    text displays such as FMAIN.dec) fail to parse. The "errors" attribute maps each file whose
+    latest version failed to parse to a dictionary of snapshot attribute name to error message.
+    Files are not parsed again until they change.
+
+    """
+
+    def __init__(self, directory='/home/greta/AXAFSHARE/dec', pattern='*.dec',
+                 glimmon_pattern='G_LIMMON*.dec', interval=5.0, settle=1.0):
+        self.directory = directory
+        self.pattern = pattern
+        self.glimmon_pattern = glimmon_pattern
+        self.interval = interval
+        self.settle = settle
+        self.snapshot = DecSnapshot()
+        self.errors = {}
+
+        self._signatures = {}
+        self._subscribers = []
+        self._check_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.check()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def subscribe(self, callback):
+        """ Register a function to be called with the changes found by each check.
+
+        :param callback: Function called as callback(changes), see check() for the format of
+                         changes. Exceptions raised by callbacks are ignored.
+
+        """
+        self._subscribers = self._subscribers + [callback]
+
+    def unsubscribe(self, callback):
+        """ Remove a function registered with subscribe().
+        """
+        self._subscribers = [func for func in self._subscribers if func is not callback]
+
+    def _scan(self):
+        """ Return a dictionary of (mtime, size) keyed by file name for the watched files.
+        """
+        signatures = {}
+        for filename in glob.glob(os.path.join(self.directory, self.pattern)):
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                # Removed since the directory was listed
+                continue
+            signatures[filename] = (stat.st_mtime, stat.st_size)
+        return signatures
+
+    def _parse(self, filename):
+        """ Run each parser that applies to a file.
+
+        :returns: Tuple of dictionaries keyed by snapshot attribute name, of the output of
+                  each parser that succeeded, and of the error message of each that failed
+
+        """
+
+        if fnmatch.fnmatch(os.path.basename(filename), self.glimmon_pattern):
+            parsers = (('glimmon', read_glimmon), ('comments', parse_comments))
+        else:
+            parsers = (('decplots', parse_decplot),)
+
+        results, errors = {}, {}
+        for key, parser in parsers:
+            try:
+                results[key] = parser(filename)
+            except Exception as err:
+                errors[key] = str(err)
+        return results, errors
+
+    def check(self):
+        """ Poll the directory once, and publish a new snapshot if any file changed.
+
+        :returns: Dictionary of changes, with 'version' (the snapshot version after the
+                  check), 'added', 'modified', 'removed', and 'failed' lists of file names, and
+                  'errors', a dictionary keyed by the file names in 'failed' of dictionaries of
+                  snapshot attribute name to error message. Files with at least one new parsed
+                  result are listed in 'added' or 'modified', files where any parser failed are
+                  listed in 'failed', and keep their previous result for that parser, if any.
+                  Returns None if nothing changed.
+
+        Calls made while another check is running (e.g. by the background thread) wait for it
+        to finish. Readers of the snapshot attribute are never blocked.
+
+        """
+
+        with self._check_lock:
+            current = self.snapshot
+            signatures = self._scan()
+            now = time.time()
+
+            changes = {'added': [], 'modified': [], 'removed': [], 'failed': [], 'errors': {}}
+            results = {}
+            for filename, signature in sorted(signatures.items()):
+                if self._signatures.get(filename) == signature:
+                    continue
+                if now - signature[0] < self.settle:
+                    # Probably still being written, parse on a later poll
+                    continue
+
+                self._signatures[filename] = signature
+                parsed, errors = self._parse(filename)
+
+                if errors:
+                    self.errors[filename] = errors
+                    changes['failed'].append(filename)
+                    changes['errors'][filename] = errors
+                else:
+                    self.errors.pop(filename, None)
+
+                if parsed:
+                    results[filename] = parsed
+                    known = any(filename in getattr(current, key)
+                                for key in ('glimmon', 'comments', 'decplots'))
+                    changes['modified' if known else 'added'].append(filename)
+
+            for filename in sorted(set(self._signatures) - set(signatures)):
+                del self._signatures[filename]
+                self.errors.pop(filename, None)
+                if any(filename in getattr(current, key)
+                       for key in ('glimmon', 'comments', 'decplots')):
+                    changes['removed'].append(filename)
+
+            if not any(changes.values()):
+                return None
+
+            changes['version'] = current.version
+            if changes['added'] or changes['modified'] or changes['removed']:
+                self.snapshot = self._update(current, changes, results)
+                changes['version'] = self.snapshot.version
+
+        for callback in self._subscribers:
+            try:
+                callback(changes)
+            except Exception:
+                pass
+
+        return changes
+
+    def _update(self, current, changes, results):
+        """ Return a new snapshot with the changed files replaced.
+        """
+        parsed = {}
+        for key in ('glimmon', 'comments', 'decplots'):
+            parsed[key] = dict(getattr(current, key))
+            for filename in changes['removed']:
+                parsed[key].pop(filename, None)
+            for filename, result in results.items():
+                if key in result:
+                    parsed[key][filename] = result[key]
+
+        return DecSnapshot(current.version + 1, **parsed)
+
+    def start(self):
+        """ Start polling in a background thread.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='DecWatcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """ Stop the background thread, waiting for a check in progress to finish.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
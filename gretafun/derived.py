@@ -0,0 +1,433 @@
+""" Vectorized evaluation of derived mnemonic equations.
+
+read_glimmon skips the equations that define derived mnemonics within a dec file. The functions
+in this module parse those equations into expression trees and evaluate them over whole
+telemetry arrays with NumPy, so that derived mnemonics can be computed locally and passed to
+limcheck.check_limits along with the mnemonics they are derived from.
+
+Equations are lines of the form:
+
+    NAME = expression
+
+Expressions may use mnemonic names (including other derived mnemonics), numbers, quoted state
+names, the operators + - * / % ** (or ^), comparisons (< <= > >= == !=), logical operators
+(&& || ! or AND OR NOT), parentheses, and the functions listed in "equation_functions" (e.g.
+ABS(x), SQRT(x), MIN(a, b, ...), MAX(a, b, ...), ATAN2(y, x), IF(condition, a, b)). Names and
+functions are not case sensitive.
+
+Subexpressions are identified by their structure, so a subexpression that appears in more than
+one equation (or more than once in one equation) is evaluated only once for each time grid.
+
+"""
+
+import re
+
+import numpy as np
+
+__all__ = ['parse_equation', 'read_equations', 'DerivedMsids', 'equation_functions']
+
+# An equation line, NAME = expression (but not NAME == expression)
+_equation_line = re.compile(r'^\s*([A-Za-z0-9_]+)\s*=(?!=)\s*(.+?)\s*$')
+
+# Expression tokens. A number must not run into a name, so that e.g. 4RT700T is a name.
+_token_pattern = re.compile(r'\s*(?:'
+                            r'(?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?(?![A-Za-z0-9_]))|'
+                            r'(?P<name>[A-Za-z0-9_]+)|'
+                            r'(?P<string>"[^"]*"|\'[^\']*\')|'
+                            r'(?P<op>\*\*|&&|\|\||<=|>=|==|!=|<>|[-+*/%^()<>!,]))')
+
+# Keywords of GRETA dec files that are never the target of an equation
+_dec_keywords = ('MLOAD', 'MLIMIT', 'MLMTOL', 'MLIMSW', 'MLMENABLE', 'MLMDEFTOL', 'MLMTHROW',
+                 'XMSID')
+
+_binary_ops = {'+': np.add, '-': np.subtract, '*': np.multiply, '/': np.true_divide,
+               '%': np.mod, '**': np.power, '<': np.less, '<=': np.less_equal,
+               '>': np.greater, '>=': np.greater_equal, '==': np.equal, '!=': np.not_equal,
+               '&&': np.logical_and, '||': np.logical_or}
+
+_comparisons = ('<', '<=', '>', '>=', '==', '!=')
+
+# Comparisons of state names
+_text_ops = {'<': np.char.less, '<=': np.char.less_equal, '>': np.char.greater,
+             '>=': np.char.greater_equal, '==': np.char.equal, '!=': np.char.not_equal}
+
+# Functions available to equations, with the number of arguments (None for any number)
+equation_functions = {'ABS': (np.abs, 1), 'SQRT': (np.sqrt, 1), 'EXP': (np.exp, 1),
+                      'LOG': (np.log, 1), 'LOG10': (np.log10, 1), 'SIN': (np.sin, 1),
+                      'COS': (np.cos, 1), 'TAN': (np.tan, 1), 'ASIN': (np.arcsin, 1),
+                      'ACOS': (np.arccos, 1), 'ATAN': (np.arctan, 1), 'ATAN2': (np.arctan2, 2),
+                      'FLOOR': (np.floor, 1), 'CEIL': (np.ceil, 1), 'ROUND': (np.round, 1),
+                      'MIN': (np.minimum, None), 'MAX': (np.maximum, None),
+                      'IF': (np.where, 3)}
+
+
+def _tokenize(text):
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = _token_pattern.match(text, pos)
+        if match is None or match.end() == pos:
+            raise ValueError('Unexpected character {!r} in equation: {}'.format(
+                text[pos:].strip()[:1], text))
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'op':
+            value = {'^': '**', '<>': '!='}.get(value, value)
+        elif kind == 'name':
+            value = value.upper()
+            if value in ('AND', 'OR', 'NOT'):
+                kind, value = 'op', {'AND': '&&', 'OR': '||', 'NOT': '!'}[value]
+        tokens.append((kind, value))
+        pos = match.end()
+    return tokens
+
+
+class _Parser(object):
+    """ Recursive descent parser producing expression trees of nested tuples.
+
+    Nodes are ('num', value), ('str', value), ('msid', name), ('neg', node), ('not', node),
+    (operator, left, right), and ('call', function, args).
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = _tokenize(text)
+        self.pos = 0
+
+    def parse(self):
+        node = self.logical_or()
+        if self.pos != len(self.tokens):
+            self.error('Unexpected {!r}'.format(self.tokens[self.pos][1]))
+        return node
+
+    def error(self, message):
+        raise ValueError('{} in equation: {}'.format(message, self.text))
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def accept(self, *ops):
+        kind, value = self.peek()
+        if kind == 'op' and value in ops:
+            self.pos += 1
+            return value
+        return None
+
+    def expect(self, op):
+        if self.accept(op) is None:
+            self.error('Expected {!r}'.format(op))
+
+    def binary(self, operand, ops):
+        node = operand()
+        op = self.accept(*ops)
+        while op is not None:
+            node = (op, node, operand())
+            op = self.accept(*ops)
+        return node
+
+    def logical_or(self):
+        return self.binary(self.logical_and, ('||',))
+
+    def logical_and(self):
+        return self.binary(self.logical_not, ('&&',))
+
+    def logical_not(self):
+        if self.accept('!'):
+            return ('not', self.logical_not())
+        return self.comparison()
+
+    def comparison(self):
+        return self.binary(self.additive, _comparisons)
+
+    def additive(self):
+        return self.binary(self.multiplicative, ('+', '-'))
+
+    def multiplicative(self):
+        return self.binary(self.unary, ('*', '/', '%'))
+
+    def unary(self):
+        if self.accept('-'):
+            return ('neg', self.unary())
+        if self.accept('+'):
+            return self.unary()
+        return self.power()
+
+    def power(self):
+        node = self.atom()
+        if self.accept('**'):
+            # Right associative, and binds more tightly than unary minus on its left
+            node = ('**', node, self.unary())
+        return node
+
+    def atom(self):
+        kind, value = self.peek()
+        if kind is None:
+            self.error('Unexpected end')
+        self.pos += 1
+
+        if kind == 'number':
+            return ('num', float(value))
+        if kind == 'string':
+            return ('str', value[1:-1])
+        if kind == 'name':
+            if self.accept('('):
+                return self.call(value)
+            return ('msid', value)
+        if value == '(':
+            node = self.logical_or()
+            self.expect(')')
+            return node
+        self.error('Unexpected {!r}'.format(value))
+
+    def call(self, name):
+        if name not in equation_functions:
+            self.error('Unknown function {}'.format(name))
+        args = []
+        if not self.accept(')'):
+            args.append(self.logical_or())
+            while self.accept(','):
+                args.append(self.logical_or())
+            self.expect(')')
+
+        nargs = equation_functions[name][1]
+        if (nargs is None and not args) or (nargs is not None and len(args) != nargs):
+            self.error('Wrong number of arguments to {}'.format(name))
+        return ('call', name, tuple(args))
+
+
+def parse_equation(text):
+    """ Parse an expression into an expression tree.
+
+    :param text: Expression, e.g. 'SQRT(AOATTQT1**2 + AOATTQT2**2)', or an equation of the form
+                 'NAME = expression', in which case only the expression is parsed
+
+    :returns: Expression tree of nested tuples
+
+    :raises ValueError: If the expression can not be parsed
+
+    """
+    match = _equation_line.match(text)
+    if match:
+        text = match.group(2)
+    return _Parser(text).parse()
+
+
+def read_equations(filename='/home/greta/AXAFSHARE/dec/G_LIMMON.dec'):
+    """ Read the derived mnemonic equations in a GRETA dec file.
+
+    :param filename: GRETA dec file name
+
+    :returns: Dictionary of upper case derived mnemonic name to equation text
+
+    Comment lines and GRETA keyword lines are ignored. If a mnemonic is defined more than once
+    the last definition is used.
+
+    """
+
+    equations = {}
+    with open(filename, 'r') as fid:
+        for line in fid:
+            if line.lstrip().startswith('#'):
+                continue
+            match = _equation_line.match(line)
+            if match and match.group(1).upper() not in _dec_keywords:
+                equations[match.group(1).upper()] = match.group(2)
+    return equations
+
+
+def _node_msids(node):
+    """ Yield the mnemonic names referenced by an expression tree, in order of appearance.
+    """
+    if node[0] == 'msid':
+        yield node[1]
+    elif node[0] == 'call':
+        for arg in node[2]:
+            for msid in _node_msids(arg):
+                yield msid
+    elif node[0] not in ('num', 'str'):
+        for child in node[1:]:
+            for msid in _node_msids(child):
+                yield msid
+
+
+def _is_text(value):
+    return isinstance(value, str) or getattr(value, 'dtype', np.dtype(float)).kind in 'SU'
+
+
+def _as_text(value):
+    if isinstance(value, str):
+        return value
+    return np.char.strip(np.asarray(value).astype(str))
+
+
+class DerivedMsids(object):
+    """ A set of derived mnemonic equations that can be evaluated over telemetry arrays.
+
+    :param equations: Dictionary of derived mnemonic name to equation text (e.g. the output of
+                      read_equations), or to an expression tree from parse_equation
+
+    Example:
+
+        derived = DerivedMsids.from_file('/home/greta/AXAFSHARE/dec/G_LIMMON.dec')
+        telemetry = fetch_eng.MSIDset(derived.inputs(), '2014:200', '2014:201')
+        telemetry = dict(telemetry)
+        telemetry.update(derived.evaluate(telemetry))
+        violations = check_limits(glimmon, telemetry)
+
+    Telemetry is supplied in the same forms accepted by limcheck.check_limits: a mapping from
+    mnemonic name to a (times, vals) tuple or an object with "times" and "vals" attributes.
+    Mnemonics sampled at different times are aligned by holding the most recent sample.
+
+    """
+
+    def __init__(self, equations):
+        self.equations = {}
+        for name, equation in equations.items():
+            if isinstance(equation, tuple):
+                self.equations[name.upper()] = equation
+            else:
+                self.equations[name.upper()] = parse_equation(equation)
+
+    @classmethod
+    def from_file(cls, filename='/home/greta/AXAFSHARE/dec/G_LIMMON.dec'):
+        """ Read the derived mnemonic equations in a GRETA dec file, see read_equations.
+        """
+        return cls(read_equations(filename))
+
+    def __contains__(self, name):
+        return name.upper() in self.equations
+
+    def inputs(self, names=None):
+        """ Return the telemetry mnemonics needed to evaluate derived mnemonics.
+
+        :param names: Derived mnemonic names, defaults to all
+
+        :returns: Sorted list of the mnemonic names that are not themselves derived
+
+        """
+        names = self.equations if names is None else [name.upper() for name in names]
+        found = set()
+        for name in names:
+            found.update(self._inputs(name, []))
+        return sorted(found)
+
+    def _inputs(self, name, resolving):
+        if name in resolving:
+            raise ValueError('Circular definition of derived mnemonic {}'.format(name))
+        found = []
+        for msid in _node_msids(self.equations[name]):
+            if msid in self.equations:
+                found.extend(self._inputs(msid, resolving + [name]))
+            else:
+                found.append(msid)
+        return found
+
+    def evaluate(self, telemetry, names=None, times=None):
+        """ Evaluate derived mnemonics.
+
+        :param telemetry: Mapping from mnemonic name to telemetry (see class documentation)
+        :param names: Derived mnemonic names to evaluate, defaults to all
+        :param times: Optional array of times at which to evaluate all derived mnemonics,
+                      by default each derived mnemonic is evaluated at the sample times of the
+                      first telemetry mnemonic in its equation
+
+        :returns: Dictionary of derived mnemonic name to (times, vals) tuple. Derived mnemonics
+                  whose inputs are not all available in telemetry are omitted.
+
+        """
+
+        data = {}
+        for key in telemetry:
+            item = telemetry[key]
+            vals = item[1] if isinstance(item, tuple) else item.vals
+            itemtimes = item[0] if isinstance(item, tuple) else item.times
+            data[key.upper()] = (np.asarray(itemtimes, dtype=np.float64), np.asarray(vals))
+
+        names = sorted(self.equations) if names is None else [name.upper() for name in names]
+        grids = {}
+        cache = {}
+        out = {}
+
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            for name in names:
+                inputs = self._inputs(name, [])
+                if any(msid not in data for msid in inputs):
+                    continue
+
+                if times is not None:
+                    grid = None
+                    grids[None] = np.asarray(times, dtype=np.float64)
+                elif inputs:
+                    grid = inputs[0]
+                    grids[grid] = data[grid][0]
+                else:
+                    # Constant expression, there is no time grid to evaluate it on
+                    continue
+
+                vals = self._evaluate(('msid', name), grid, grids[grid], data, cache)
+                vals = np.broadcast_to(vals, grids[grid].shape).copy()
+                out[name] = (grids[grid], vals)
+
+        return out
+
+    def _evaluate(self, node, grid, gridtimes, data, cache):
+        """ Evaluate an expression tree on a time grid, caching every subexpression.
+        """
+
+        key = (grid, node)
+        if key in cache:
+            return cache[key]
+
+        kind = node[0]
+        if kind in ('num', 'str'):
+            value = node[1]
+
+        elif kind == 'msid':
+            if node[1] in self.equations:
+                value = self._evaluate(self.equations[node[1]], grid, gridtimes, data, cache)
+            else:
+                value = self._sample(data[node[1]], gridtimes)
+
+        elif kind == 'neg':
+            value = np.negative(self._evaluate(node[1], grid, gridtimes, data, cache))
+
+        elif kind == 'not':
+            value = np.logical_not(self._evaluate(node[1], grid, gridtimes, data, cache))
+
+        elif kind == 'call':
+            func, nargs = equation_functions[node[1]]
+            args = [self._evaluate(arg, grid, gridtimes, data, cache) for arg in node[2]]
+            if nargs is None:
+                value = args[0]
+                for arg in args[1:]:
+                    value = func(value, arg)
+            else:
+                value = func(*args)
+
+        else:
+            left = self._evaluate(node[1], grid, gridtimes, data, cache)
+            right = self._evaluate(node[2], grid, gridtimes, data, cache)
+            if kind in _comparisons and (_is_text(left) or _is_text(right)):
+                value = _text_ops[kind](_as_text(left), _as_text(right))
+            else:
+                if kind not in _comparisons and kind not in ('&&', '||'):
+                    left = np.asarray(left, dtype=np.float64)
+                    right = np.asarray(right, dtype=np.float64)
+                value = _binary_ops[kind](left, right)
+
+        cache[key] = value
+        return value
+
+    @staticmethod
+    def _sample(item, gridtimes):
+        """ Return the values of a telemetry mnemonic at the grid times (most recent sample).
+        """
+        times, vals = item
+        if times is gridtimes or (len(times) == len(gridtimes) and
+                                  np.array_equal(times, gridtimes)):
+            return vals
+        if len(times) == 0:
+            return np.full(len(gridtimes), np.nan)
+        ind = np.searchsorted(times, gridtimes, side='right') - 1
+        return vals[np.clip(ind, 0, len(vals) - 1)]
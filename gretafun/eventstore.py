@@ -0,0 +1,360 @@
+""" Columnar store of the individual events recorded in GRETA limit files.
+
+process_limits_file reduces a limit file to a per-mnemonic summary. The EventStore class keeps
+every event instead, as columns of NumPy arrays (time in seconds, mnemonic id, status code,
+value, operator, and limit), so that the events for any mnemonics and time range, and counts
+of events per status per hour, can be found without reading the limit files again.
+
+A store is a directory holding a JSON catalog and one .npz chunk file per append. The catalog
+lists the mnemonic, status, operator, and state names that ids refer to, and the time range of
+each chunk. Each chunk is sorted by time and includes an index of the rows of each mnemonic, so
+queries only load the chunks that overlap the requested time range and use binary search
+within them. Appending new limit files writes new chunks and rewrites only the catalog.
+
+"""
+
+import collections
+import datetime
+import json
+import os
+import threading
+
+import numpy as np
+
+from .gretatime import greta_to_secs, as_secs
+from .limcheck import limit_status_names
+
+__all__ = ['EventStore']
+
+_catalog_name = 'catalog.json'
+_catalog_version = 1
+
+# Comparison operators found in limit files, indexed by operator id
+_operators = ('', '<', '>', '!=', '=', '==', '<=', '>=')
+
+# Columns stored for each event
+_event_columns = ('secs', 'msid', 'status', 'value', 'opr', 'limit', 'value_text', 'limit_text')
+
+
+def _number(word):
+    try:
+        return float(word)
+    except ValueError:
+        return None
+
+
+class EventStore(object):
+    """ Columnar store of GRETA limit file events.
+
+    :param directory: Store directory, created if it does not exist
+    :param chunksize: Maximum number of events in each chunk file
+    :param maxchunks: Number of loaded chunks kept in memory
+
+    Example:
+
+        store = EventStore('/data/limit_events')
+        store.append('limfile_2014205.txt')
+        events = store.query('2014:205:12:00:00', '2014:205:13:00:00', msids=['TEPHIN'])
+        hours, counts = store.hourly_counts('2014:200', '2014:210')
+
+    Each event has a time ('secs'), mnemonic ('msid'), status ('status', e.g. 'CAUTION-HIGH'),
+    numeric value and limit ('value' and 'limit', NaN if missing or not numeric), comparison
+    operator ('opr'), and for state mnemonics the state names ('value_text' and 'limit_text').
+    Corrupted lines with a missing value are stored with a NaN value and empty value_text.
+
+    """
+
+    def __init__(self, directory, chunksize=1000000, maxchunks=8):
+        self.directory = directory
+        self.chunksize = chunksize
+        self.maxchunks = maxchunks
+        self._loaded = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.refresh()
+
+    def refresh(self):
+        """ Reload the catalog, to see chunks appended by another process.
+        """
+        catalogfile = os.path.join(self.directory, _catalog_name)
+        if os.path.exists(catalogfile):
+            with open(catalogfile, 'r') as fid:
+                self.catalog = json.load(fid)
+            if self.catalog.get('version') != _catalog_version:
+                raise ValueError('{} has unsupported catalog version {}'.format(
+                    catalogfile, self.catalog.get('version')))
+        else:
+            self.catalog = {'version': _catalog_version, 'msids': [],
+                            'statuses': list(limit_status_names), 'operators': list(_operators),
+                            'strings': [], 'chunks': []}
+
+        self._ids = dict((key, dict((name, n) for n, name in enumerate(self.catalog[key])))
+                         for key in ('msids', 'statuses', 'operators', 'strings'))
+
+    def __len__(self):
+        return sum(chunk['rows'] for chunk in self.catalog['chunks'])
+
+    @property
+    def msids(self):
+        """ Sorted list of the mnemonics with events in the store.
+        """
+        return sorted(self.catalog['msids'])
+
+    def _id(self, key, name):
+        ids = self._ids[key]
+        if name not in ids:
+            ids[name] = len(self.catalog[key])
+            self.catalog[key].append(name)
+        return ids[name]
+
+    def append(self, filename):
+        """ Add the events in a limit file to the store.
+
+        :param filename: File name of G_LIMMON output file
+
+        :returns: Number of events added
+
+        """
+        with open(filename, 'r') as fid:
+            return self.append_lines(fid, source=os.path.abspath(filename))
+
+    def append_lines(self, lines, source=None):
+        """ Add the events in limit file lines to the store.
+
+        :param lines: Iterable of lines read from a GRETA limit file
+        :param source: Optional description of where the lines came from, kept in the catalog
+
+        :returns: Number of events added
+
+        """
+
+        added = 0
+        batch = []
+        for line in lines:
+            words = line.split()
+            if len(words) >= 5:
+                batch.append(words)
+            if len(batch) >= self.chunksize:
+                added += self._write_chunk(batch, source)
+                batch = []
+        if batch:
+            added += self._write_chunk(batch, source)
+
+        return added
+
+    def _write_chunk(self, rows, source):
+        with self._lock:
+            # Another process may have appended since this store was opened
+            self.refresh()
+
+            msid = np.array([self._id('msids', words[2]) for words in rows], dtype=np.int32)
+            status = np.array([self._id('statuses', words[3]) for words in rows], dtype=np.int16)
+
+            value = np.full(len(rows), np.nan)
+            limit = np.full(len(rows), np.nan)
+            value_text = np.full(len(rows), -1, dtype=np.int32)
+            limit_text = np.full(len(rows), -1, dtype=np.int32)
+            opr = np.zeros(len(rows), dtype=np.int8)
+
+            for n, words in enumerate(rows):
+                # 5 columns for a return to NOMINAL, 7 for a violation, and 6 for a violation
+                # with a missing value
+                if len(words) == 6:
+                    words = words[:4] + [None] + words[4:]
+                if words[4] is not None:
+                    number = _number(words[4])
+                    if number is None:
+                        value_text[n] = self._id('strings', words[4])
+                    else:
+                        value[n] = number
+                if len(words) >= 7:
+                    opr[n] = self._id('operators', words[5])
+                    number = _number(words[6])
+                    if number is None:
+                        limit_text[n] = self._id('strings', words[6])
+                    else:
+                        limit[n] = number
+
+            secs = greta_to_secs([words[0] for words in rows])
+
+            columns = {'secs': secs, 'msid': msid, 'status': status, 'value': value,
+                       'opr': opr, 'limit': limit, 'value_text': value_text,
+                       'limit_text': limit_text}
+            order = np.argsort(secs, kind='mergesort')
+            for col in _event_columns:
+                columns[col] = columns[col][order]
+
+            # Rows of each mnemonic in time order, for per-mnemonic queries
+            byid = np.argsort(columns['msid'], kind='mergesort').astype(np.int64)
+            index_msids, index_starts = np.unique(columns['msid'][byid], return_index=True)
+            columns['index_rows'] = byid
+            columns['index_msids'] = index_msids.astype(np.int32)
+            columns['index_bounds'] = np.append(index_starts, len(byid)).astype(np.int64)
+
+            chunkname = 'chunk_{:06d}.npz'.format(len(self.catalog['chunks']))
+            tmpname = os.path.join(self.directory, chunkname + '.tmp.npz')
+            np.savez(tmpname, **columns)
+            os.rename(tmpname, os.path.join(self.directory, chunkname))
+
+            self.catalog['chunks'].append({'file': chunkname,
+                                           'tstart': float(columns['secs'][0]),
+                                           'tstop': float(columns['secs'][-1]),
+                                           'rows': len(rows),
+                                           'source': source})
+            self._save_catalog()
+
+        return len(rows)
+
+    def _save_catalog(self):
+        catalogfile = os.path.join(self.directory, _catalog_name)
+        tmpname = catalogfile + '.tmp{}'.format(os.getpid())
+        with open(tmpname, 'w') as fid:
+            json.dump(self.catalog, fid)
+        os.rename(tmpname, catalogfile)
+
+    def _chunk(self, chunk):
+        """ Return the arrays of a chunk, keeping recently used chunks in memory.
+        """
+        name = chunk['file']
+        with self._lock:
+            if name in self._loaded:
+                self._loaded[name] = self._loaded.pop(name)
+                return self._loaded[name]
+
+        with np.load(os.path.join(self.directory, name)) as npz:
+            arrays = dict((key, npz[key]) for key in npz.files)
+
+        with self._lock:
+            self._loaded[name] = arrays
+            while len(self._loaded) > self.maxchunks:
+                self._loaded.popitem(last=False)
+        return arrays
+
+    def _select(self, tstart, tstop, msids):
+        """ Return the event columns (as ids) in a time range, sorted by time.
+        """
+
+        tstart = -np.inf if tstart is None else as_secs(tstart)
+        tstop = np.inf if tstop is None else as_secs(tstop)
+        if msids is not None:
+            ids = np.array(sorted(self._ids['msids'][msid] for msid in msids
+                                  if msid in self._ids['msids']), dtype=np.int32)
+
+        parts = []
+        for chunk in self.catalog['chunks']:
+            if chunk['tstop'] < tstart or chunk['tstart'] > tstop:
+                continue
+            arrays = self._chunk(chunk)
+            secs = arrays['secs']
+
+            if msids is None:
+                i0 = np.searchsorted(secs, tstart, side='left')
+                i1 = np.searchsorted(secs, tstop, side='right')
+                rows = np.arange(i0, i1)
+            else:
+                rows = []
+                for p in np.flatnonzero(np.isin(arrays['index_msids'], ids)):
+                    msidrows = arrays['index_rows'][arrays['index_bounds'][p]:
+                                                    arrays['index_bounds'][p + 1]]
+                    i0 = np.searchsorted(secs[msidrows], tstart, side='left')
+                    i1 = np.searchsorted(secs[msidrows], tstop, side='right')
+                    rows.append(msidrows[i0:i1])
+                rows = np.sort(np.concatenate(rows)) if rows else np.zeros(0, dtype=np.int64)
+
+            parts.append(dict((col, arrays[col][rows]) for col in _event_columns))
+
+        if not parts:
+            return dict((col, np.zeros(0)) for col in _event_columns)
+
+        columns = dict((col, np.concatenate([part[col] for part in parts]))
+                       for col in _event_columns)
+        if len(parts) > 1:
+            # Chunks appended out of time order may overlap
+            order = np.argsort(columns['secs'], kind='mergesort')
+            columns = dict((col, columns[col][order]) for col in _event_columns)
+        return columns
+
+    def query(self, tstart=None, tstop=None, msids=None):
+        """ Return the events in a time range.
+
+        :param tstart: Start time (inclusive), in seconds or any format accepted by DateTime,
+                       defaults to the first event
+        :param tstop: Stop time (inclusive), in seconds or any format accepted by DateTime,
+                      defaults to the last event
+        :param msids: Optional list of mnemonic names, to only return events for these
+
+        :returns: Dictionary of equal length NumPy arrays sorted by time, with 'secs', 'msid',
+                  'status', 'value', 'opr', 'limit', 'value_text', and 'limit_text' columns
+
+        """
+
+        columns = self._select(tstart, tstop, msids)
+
+        def names(key, ids):
+            table = np.array(self.catalog[key] + [''], dtype=str)
+            return table[ids.astype(np.int64)]
+
+        return {'secs': columns['secs'].astype(np.float64),
+                'msid': names('msids', columns['msid']),
+                'status': names('statuses', columns['status']),
+                'value': columns['value'].astype(np.float64),
+                'opr': names('operators', columns['opr']),
+                'limit': columns['limit'].astype(np.float64),
+                'value_text': names('strings', columns['value_text']),
+                'limit_text': names('strings', columns['limit_text'])}
+
+    def hourly_counts(self, tstart=None, tstop=None, msids=None):
+        """ Count events per status in each hour of a time range.
+
+        :param tstart: Start time, in seconds or any format accepted by DateTime, defaults to
+                       the first event
+        :param tstop: Stop time, in seconds or any format accepted by DateTime, defaults to the
+                      last event
+        :param msids: Optional list of mnemonic names, to only count events for these
+
+        :returns: Tuple of (hours, counts), where hours is an array of the start time in
+                  seconds of each UTC hour, counted from the start of the UTC hour containing
+                  tstart, and counts is a dictionary of status name to an array of the number
+                  of events in each hour
+
+        Hours are clock (UTC) hours. Chandra.Time seconds are offset from UTC and count leap
+        seconds, so the hour boundaries are found with DateTime rather than by dividing the
+        seconds by 3600.
+
+        """
+
+        columns = self._select(tstart, tstop, msids)
+        secs = columns['secs']
+        statuses = self.catalog['statuses']
+
+        if len(secs) == 0 and (tstart is None or tstop is None):
+            return np.zeros(0), dict((str(status), np.zeros(0, dtype=np.int64))
+                                     for status in statuses)
+
+        first = as_secs(tstart) if tstart is not None else secs[0]
+        last = as_secs(tstop) if tstop is not None else secs[-1]
+        edges = _utc_hours(first, last)
+        nhours = len(edges) - 1
+
+        hour = np.searchsorted(edges, secs, side='right') - 1
+        bins = np.bincount(hour * len(statuses) + columns['status'].astype(np.int64),
+                           minlength=nhours * len(statuses)).reshape(nhours, len(statuses))
+
+        hours = edges[:-1]
+        return hours, dict((str(status), bins[:, n]) for n, status in enumerate(statuses))
+
+
+def _utc_hours(first, last):
+    """ Return the times in seconds of the start of each UTC hour, from the hour containing
+    first to the end of the hour containing last.
+    """
+    from Chandra.Time import DateTime
+
+    start, stop = [datetime.datetime.strptime(str(date)[:11], '%Y:%j:%H')
+                   for date in DateTime(np.array([first, last], dtype=np.float64)).date]
+    nhours = int((stop - start).total_seconds() // 3600) + 1
+    dates = [(start + datetime.timedelta(hours=n)).strftime('%Y:%j:%H:00:00.000')
+             for n in range(nhours + 1)]
+    return np.asarray(DateTime(np.array(dates)).secs, dtype=np.float64)
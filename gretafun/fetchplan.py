@@ -0,0 +1,179 @@
+""" Plan and perform telemetry fetches for GRETA dec plot displays.
+
+A wall of displays typically shows many of the same mnemonics. The FetchPlan class collects the
+distinct mnemonics used by the traces and bilevel traces of one or more parsed dec plot files
+(see gretaparse.parse_decplot), fetches each mnemonic only once over the union of the time
+ranges of the displays that use it, and then hands each trace a view of the fetched arrays
+limited to its own display time range.
+
+Telemetry is read from a data source, which is any callable that accepts a list of mnemonic
+names and start and stop times in seconds, and returns a mapping of mnemonic name to either a
+(times, vals) tuple or an object with "times" and "vals" attributes. By default the Ska
+engineering archive is used.
+
+"""
+
+import numpy as np
+
+from .gretatime import as_secs
+
+__all__ = ['FetchPlan', 'archive_source', 'trace_msids']
+
+
+def archive_source(msids, start, stop):
+    """ Fetch telemetry for a list of mnemonics from the Ska engineering archive.
+
+    :param msids: List of mnemonic names
+    :param start: Start time in seconds
+    :param stop: Stop time in seconds
+
+    :returns: Dictionary of mnemonic name to fetch_eng.Msid
+
+    All mnemonics are requested together; if any are not in the archive they are fetched
+    individually and the missing mnemonics are omitted.
+
+    """
+
+    import Ska.engarchive.fetch_eng as fetch_eng
+
+    try:
+        return dict(fetch_eng.MSIDset(msids, start, stop))
+    except ValueError:
+        pass
+
+    data = {}
+    for msid in msids:
+        try:
+            data[msid] = fetch_eng.Msid(msid, start, stop)
+        except ValueError:
+            continue
+    return data
+
+
+def trace_msids(decplots):
+    """ Yield (plot number, trace kind, trace number, mnemonic) for every trace in a display.
+
+    :param decplots: Output of parse_decplot for one display
+
+    The trace kind is 'traces' for traces (TINDEX) and 'tbtraces' for bilevel traces
+    (TBLINDEX). Traces without a TMSID are skipped, and mnemonics are returned in upper case.
+
+    """
+    for num, plot in decplots['plots'].items():
+        for kind in ('traces', 'tbtraces'):
+            for tnum, trace in plot.get(kind, {}).items():
+                if trace.get('TMSID'):
+                    yield num, kind, tnum, trace['TMSID'].upper()
+
+
+class FetchPlan(object):
+    """ Plan a deduplicated set of telemetry fetches for one or more dec plot displays.
+
+    :param decplots: Output of parse_decplot, a list of such outputs, or a dictionary of such
+                     outputs (e.g. from parse_decplot_dir)
+    :param stop: End of the time range, in seconds or any format accepted by DateTime,
+                 defaults to the current time
+    :param start: Start of the time range, if not given each display covers the range defined
+                  by its DXAXIS relative to stop
+
+    After creation, the "windows" attribute maps each mnemonic to its (start, stop) fetch range,
+    and the "requests" attribute lists the (start, stop, msids) batches that fetch() will issue,
+    one per unique time range.
+
+    Example:
+
+        displays = parse_decplot_dir('/home/greta/AXAFSHARE/dec')
+        plan = FetchPlan(displays, stop='2014:205')
+        data = plan.fetch()
+        times, vals = data['/home/greta/AXAFSHARE/dec/thermal.dec'][1]['traces'][1]
+
+    """
+
+    def __init__(self, decplots, stop=None, start=None):
+        if 'plots' in decplots:
+            self.single = True
+            self.displays = {None: decplots}
+        elif isinstance(decplots, dict):
+            self.single = False
+            self.displays = dict(decplots)
+        else:
+            self.single = False
+            self.displays = dict(enumerate(decplots))
+
+        stop = as_secs(stop)
+        start = as_secs(start) if start is not None else None
+
+        # Time range of each display
+        self.ranges = {}
+        for key, display in self.displays.items():
+            if start is not None:
+                self.ranges[key] = (start, stop)
+            else:
+                xaxis = display.get('DXAXIS') or [0, 0]
+                self.ranges[key] = (stop + xaxis[0], stop + xaxis[1])
+
+        # Union of the time ranges of all displays that use each mnemonic
+        self.windows = {}
+        for key, display in self.displays.items():
+            tstart, tstop = self.ranges[key]
+            for num, kind, tnum, msid in trace_msids(display):
+                if msid in self.windows:
+                    wstart, wstop = self.windows[msid]
+                    self.windows[msid] = (min(wstart, tstart), max(wstop, tstop))
+                else:
+                    self.windows[msid] = (tstart, tstop)
+
+        # One request per unique time range
+        batches = {}
+        for msid, window in self.windows.items():
+            batches.setdefault(window, []).append(msid)
+        self.requests = [(window[0], window[1], sorted(msids))
+                         for window, msids in sorted(batches.items())]
+
+    @property
+    def msids(self):
+        """ Sorted list of the distinct mnemonics used by all displays.
+        """
+        return sorted(self.windows)
+
+    def fetch(self, source=None):
+        """ Fetch telemetry for all displays.
+
+        :param source: Data source (see module documentation), defaults to archive_source
+
+        :returns: Dictionary keyed by display (as in the decplots argument) of dictionaries
+                  keyed by plot number, each with 'traces' and 'tbtraces' dictionaries of
+                  (times, vals) tuples keyed by trace number. If a single display was planned,
+                  the dictionary keyed by plot number is returned directly.
+
+        Each trace receives slices of the fetched arrays (not copies) covering its display
+        time range. Traces whose mnemonic was not returned by the source are omitted.
+
+        """
+
+        source = source if source is not None else archive_source
+
+        data = {}
+        for tstart, tstop, msids in self.requests:
+            fetched = source(msids, tstart, tstop)
+            for msid in msids:
+                if msid in fetched:
+                    item = fetched[msid]
+                    times, vals = item if isinstance(item, tuple) else (item.times, item.vals)
+                    data[msid] = (np.asarray(times), np.asarray(vals))
+
+        out = {}
+        for key, display in self.displays.items():
+            tstart, tstop = self.ranges[key]
+            plots = {}
+            for num, kind, tnum, msid in trace_msids(display):
+                plot = plots.setdefault(num, {'traces': {}, 'tbtraces': {}})
+                if msid not in data:
+                    continue
+                times, vals = data[msid]
+                i0 = np.searchsorted(times, tstart, side='left')
+                i1 = np.searchsorted(times, tstop, side='right')
+                plot[kind][tnum] = (times[i0:i1], vals[i0:i1])
+            out[key] = plots
+
+        return out[None] if self.single else out
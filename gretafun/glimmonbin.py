@@ -0,0 +1,310 @@
+""" Compact binary format for parsed GRETA limit monitoring specifications.
+
+The nested dictionary returned by gretaparse.read_glimmon is large, and each process that
+parses a specification holds its own copy. write_glimmon_binary stores a parsed specification
+as fixed width NumPy records in a single file, which GlimmonBinary maps into memory read-only
+with np.memmap, so any number of processes can share the same pages, and look up mnemonics
+without materializing the full dictionary.
+
+File layout (all values little endian, each section aligned to 8 bytes):
+
+  - Header: magic string, format version, record counts, and section offsets
+  - Mnemonic table: one record per mnemonic, sorted by name, with the name (fixed width), the
+    first row and number of rows in the limit set table, and the type, default set number,
+    mlmtol, mlmenable, and mlimsw string id
+  - Limit set table: one record per limit set, in mnemonic order and then in file order, with
+    the mnemonic id, set number, the four limits (NaN if not defined), expected state and
+    switch state string ids, default flag, mlmtol, and mlmenable
+  - String table: offsets into a block of ASCII string data, referenced by string ids
+  - Specification metadata (revision, version, database, mlmdeftol, mlmthrow) as JSON
+
+Missing integer values and string ids are stored as -1.
+
+"""
+
+import json
+import os
+
+import numpy as np
+
+from .gretaparse import read_glimmon, _limit_columns
+
+__all__ = ['write_glimmon_binary', 'GlimmonBinary']
+
+_magic = b'GRETALIM'
+_format_version = 1
+
+_header_dtype = np.dtype([('magic', 'S8'), ('version', '<u4'), ('nmsids', '<u4'),
+                          ('nsets', '<u4'), ('nstrings', '<u4'), ('namewidth', '<u4'),
+                          ('reserved', '<u4'), ('msid_offset', '<u8'), ('set_offset', '<u8'),
+                          ('string_offset', '<u8'), ('data_offset', '<u8'),
+                          ('data_size', '<u8'), ('meta_offset', '<u8'), ('meta_size', '<u8')])
+
+_set_dtype = np.dtype([('msid', '<u4'), ('setnum', '<i4'), ('warning_low', '<f8'),
+                       ('caution_low', '<f8'), ('caution_high', '<f8'), ('warning_high', '<f8'),
+                       ('expst', '<i4'), ('switchstate', '<i4'), ('default', 'u1'),
+                       ('mlmenable', 'i1'), ('reserved', '<i2'), ('mlmtol', '<i4')])
+
+# Codes used for the mnemonic type
+_types = (None, 'limit', 'expected_state')
+
+# Specification level keys stored as metadata
+_spec_keys = ('revision', 'version', 'database', 'mlmdeftol', 'mlmthrow')
+
+
+def _msid_dtype(namewidth):
+    return np.dtype([('name', 'S{}'.format(namewidth)), ('first', '<u4'), ('nsets', '<u4'),
+                     ('type', 'i1'), ('mlmenable', 'i1'), ('reserved', '<i2'),
+                     ('default', '<i4'), ('mlmtol', '<i4'), ('mlimsw', '<i4')])
+
+
+def _align(offset):
+    return (offset + 7) // 8 * 8
+
+
+class _StringTable(object):
+    """ Assign ids to distinct strings, in order of first use.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def add(self, value):
+        if value is None:
+            return -1
+        if value not in self.ids:
+            self.ids[value] = len(self.strings)
+            self.strings.append(value)
+        return self.ids[value]
+
+
+def write_glimmon_binary(glimmon, filename):
+    """ Write a limit monitoring specification to a compact binary file.
+
+    :param glimmon: Dictionary returned by read_glimmon, or the file name of a GRETA limit
+                    monitoring specification file
+    :param filename: Output file name, conventionally with a .glb extension
+
+    The file is written to a temporary name and renamed, so processes that have the previous
+    version mapped continue to see a complete file.
+
+    """
+
+    if not isinstance(glimmon, dict):
+        glimmon = read_glimmon(glimmon)
+
+    names = sorted(name for name, entry in glimmon.items() if isinstance(entry, dict))
+    strings = _StringTable()
+
+    namewidth = max([len(name) for name in names] or [1])
+    msids = np.zeros(len(names), dtype=_msid_dtype(namewidth))
+    nsets = sum(len(glimmon[name].get('setkeys', [])) for name in names)
+    sets = np.zeros(nsets, dtype=_set_dtype)
+
+    row = 0
+    for n, name in enumerate(names):
+        entry = glimmon[name]
+        setkeys = entry.get('setkeys', [])
+        default = entry.get('default', -1)
+        mlmtol = entry.get('mlmtol', -1)
+        mlmenable = entry.get('mlmenable', -1)
+
+        msids[n] = (name.encode('ascii'), row, len(setkeys), _types.index(entry.get('type')),
+                    mlmenable, 0, default, mlmtol, strings.add(entry.get('mlimsw')))
+
+        for setnum in setkeys:
+            limitset = entry[setnum]
+            sets[row] = ((n, setnum) + tuple(limitset.get(col, np.nan) for col in _limit_columns)
+                         + (strings.add(limitset.get('expst')),
+                            strings.add(limitset.get('switchstate')),
+                            setnum == default, mlmenable, 0, mlmtol))
+            row += 1
+
+    encoded = [value.encode('ascii') for value in strings.strings]
+    offsets = np.zeros(len(encoded) + 1, dtype='<u8')
+    offsets[1:] = np.cumsum([len(value) for value in encoded])
+    data = b''.join(encoded)
+
+    metadata = json.dumps(dict((key, glimmon[key]) for key in _spec_keys if key in glimmon))
+    metadata = metadata.encode('utf-8')
+
+    header = np.zeros(1, dtype=_header_dtype)
+    position = _align(_header_dtype.itemsize)
+    sections = []
+    for field, block in (('msid_offset', msids.tobytes()), ('set_offset', sets.tobytes()),
+                         ('string_offset', offsets.tobytes()), ('data_offset', data),
+                         ('meta_offset', metadata)):
+        header[field] = position
+        sections.append((position, block))
+        position = _align(position + len(block))
+
+    header['magic'] = _magic
+    header['version'] = _format_version
+    header['nmsids'] = len(msids)
+    header['nsets'] = len(sets)
+    header['nstrings'] = len(encoded)
+    header['namewidth'] = namewidth
+    header['data_size'] = len(data)
+    header['meta_size'] = len(metadata)
+
+    tmpname = filename + '.tmp{}'.format(os.getpid())
+    with open(tmpname, 'wb') as fid:
+        fid.write(header.tobytes())
+        for offset, block in sections:
+            fid.write(b'\0' * (offset - fid.tell()))
+            fid.write(block)
+    os.rename(tmpname, filename)
+
+
+class GlimmonBinary(object):
+    """ Read-only, memory mapped view of a binary limit monitoring specification.
+
+    :param filename: File written by write_glimmon_binary
+
+    The "msid_table" and "sets" attributes are NumPy structured arrays backed by the mapped file.
+    Mnemonic entries are built on request by lookup() or indexing, in the same format as the
+    corresponding entries of the read_glimmon dictionary:
+
+        spec = GlimmonBinary('G_LIMMON.glb')
+        spec['TEPHIN'][0]['caution_high']
+        spec.revision
+
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._raw = np.memmap(filename, dtype=np.uint8, mode='r')
+
+        header = self._raw[:_header_dtype.itemsize].view(_header_dtype)[0]
+        if header['magic'] != _magic:
+            raise ValueError('{} is not a binary limit specification file'.format(filename))
+        if header['version'] != _format_version:
+            raise ValueError('{} has unsupported format version {}'.format(
+                filename, header['version']))
+
+        self.msid_table = self._section(header['msid_offset'], header['nmsids'],
+                                        _msid_dtype(int(header['namewidth'])))
+        self.sets = self._section(header['set_offset'], header['nsets'], _set_dtype)
+        self._offsets = self._section(header['string_offset'], header['nstrings'] + 1,
+                                      np.dtype('<u8'))
+        data_offset = int(header['data_offset'])
+        self._data = self._raw[data_offset:data_offset + int(header['data_size'])]
+
+        meta_offset = int(header['meta_offset'])
+        meta = self._raw[meta_offset:meta_offset + int(header['meta_size'])].tobytes()
+        self.metadata = dict((str(key), value if isinstance(value, int) else str(value))
+                             for key, value in json.loads(meta.decode('utf-8')).items())
+        self._strings = {}
+
+    def _section(self, offset, count, dtype):
+        offset = int(offset)
+        return self._raw[offset:offset + int(count) * dtype.itemsize].view(dtype)
+
+    def _string(self, sid):
+        if sid < 0:
+            return None
+        if sid not in self._strings:
+            start, stop = int(self._offsets[sid]), int(self._offsets[sid + 1])
+            self._strings[sid] = str(self._data[start:stop].tobytes().decode('ascii'))
+        return self._strings[sid]
+
+    def __getattr__(self, name):
+        # Specification level values such as revision and database
+        if name in _spec_keys:
+            return self.metadata.get(name)
+        raise AttributeError(name)
+
+    def __len__(self):
+        return len(self.msid_table)
+
+    def __contains__(self, msid):
+        return self._index(msid) is not None
+
+    def __getitem__(self, msid):
+        entry = self.lookup(msid)
+        if entry is None:
+            raise KeyError(msid)
+        return entry
+
+    def msids(self):
+        """ Return a sorted list of the mnemonic names in the specification.
+        """
+        return [str(name.decode('ascii')) for name in self.msid_table['name'].tolist()]
+
+    def _index(self, msid):
+        key = msid.encode('ascii')
+        names = self.msid_table['name']
+        ind = int(np.searchsorted(names, key))
+        if ind < len(names) and names[ind] == key:
+            return ind
+        return None
+
+    def lookup(self, msid):
+        """ Return the definition of one mnemonic.
+
+        :param msid: Mnemonic name, as it appears in the specification
+
+        :returns: Dictionary in the same format as read_glimmon()[msid], or None if the
+                  mnemonic is not in the specification
+
+        """
+
+        ind = self._index(msid)
+        if ind is None:
+            return None
+
+        record = self.msid_table[ind]
+        entry = {}
+        if record['type'] > 0:
+            entry['type'] = _types[record['type']]
+        if record['default'] >= 0:
+            entry['default'] = int(record['default'])
+        if record['mlmtol'] >= 0:
+            entry['mlmtol'] = int(record['mlmtol'])
+        if record['mlmenable'] >= 0:
+            entry['mlmenable'] = int(record['mlmenable'])
+        if record['mlimsw'] >= 0:
+            entry['mlimsw'] = self._string(int(record['mlimsw']))
+
+        first = int(record['first'])
+        rows = self.sets[first:first + int(record['nsets'])]
+        if len(rows):
+            entry['setkeys'] = [int(setnum) for setnum in rows['setnum']]
+        for row in rows:
+            limitset = {}
+            if row['switchstate'] >= 0:
+                limitset['switchstate'] = self._string(int(row['switchstate']))
+            if not np.isnan(row['warning_low']):
+                for col in _limit_columns:
+                    limitset[col] = float(row[col])
+            if row['expst'] >= 0:
+                limitset['expst'] = self._string(int(row['expst']))
+            entry[int(row['setnum'])] = limitset
+
+        return entry
+
+    def to_columns(self):
+        """ Return the limit sets as columnar NumPy arrays, see gretaparse.glimmon_to_columns.
+        """
+
+        def strings(ids):
+            return np.array([self._string(sid) or '' for sid in ids.tolist()], dtype=str)
+
+        names = np.array(self.msids(), dtype=str)
+        columns = {'msid': names[self.sets['msid']],
+                   'setnum': self.sets['setnum'].astype(np.int32),
+                   'switchstate': strings(self.sets['switchstate']),
+                   'expst': strings(self.sets['expst']),
+                   'default': self.sets['default'].astype(bool)}
+        for col in _limit_columns:
+            columns[col] = self.sets[col].astype(np.float64)
+
+        return columns
+
+    def to_glimmon(self):
+        """ Return the full specification in the same format as read_glimmon.
+        """
+        glimmon = dict((msid, self.lookup(msid)) for msid in self.msids())
+        glimmon.update(self.metadata)
+        return glimmon
@@ -0,0 +1,167 @@
+""" Compare revisions of a GRETA limit monitoring specification.
+
+The functions in this module compare two parsed G_LIMMON specifications (as returned by
+gretaparse.read_glimmon). Each mnemonic definition is reduced to a hash of a canonical form, so
+only mnemonics whose hashes differ need to be compared in detail, and the cost of a comparison
+is linear in the size of the specifications.
+
+"""
+
+import glob
+import hashlib
+import os
+
+from .parsecache import default_cache
+
+__all__ = ['diff_glimmon', 'diff_glimmon_dir']
+
+# Top level keys that describe the specification as a whole rather than a mnemonic
+_spec_keys = ('revision', 'version', 'database', 'mlmdeftol', 'mlmthrow')
+
+# Mnemonic level keys that are compared individually
+_msid_keys = ('type', 'default', 'mlmtol', 'mlimsw', 'mlmenable')
+
+
+def _canonical(value):
+    """ Return a string representation of a parsed value that does not depend on dict ordering.
+    """
+    if isinstance(value, dict):
+        items = sorted((str(key), _canonical(val)) for key, val in value.items())
+        return '{' + ','.join('{}:{}'.format(key, val) for key, val in items) + '}'
+    return repr(value)
+
+
+def _spec_hashes(glimmon):
+    """ Return a dictionary of mnemonic name to hash of the canonical mnemonic definition.
+    """
+    hashes = {}
+    for name, entry in glimmon.items():
+        if isinstance(entry, dict):
+            hashes[name] = hashlib.sha1(_canonical(entry).encode('utf-8')).hexdigest()
+    return hashes
+
+
+def _load(spec, cache):
+    if isinstance(spec, dict):
+        return spec
+    return cache.read_glimmon(spec)
+
+
+def _diff_msid(old, new):
+    """ Return the differences between two definitions of the same mnemonic.
+    """
+
+    changes = {}
+
+    for key in _msid_keys:
+        if old.get(key) != new.get(key):
+            changes[key] = (old.get(key), new.get(key))
+
+    oldsets = set(old.get('setkeys', []))
+    newsets = set(new.get('setkeys', []))
+
+    added = sorted(newsets - oldsets)
+    removed = sorted(oldsets - newsets)
+    changed = {}
+    for setnum in sorted(oldsets & newsets):
+        if old[setnum] != new[setnum]:
+            changed[setnum] = {'old': old[setnum], 'new': new[setnum]}
+
+    if added:
+        changes['sets_added'] = dict((setnum, new[setnum]) for setnum in added)
+    if removed:
+        changes['sets_removed'] = dict((setnum, old[setnum]) for setnum in removed)
+    if changed:
+        changes['sets_changed'] = changed
+    if old.get('setkeys') != new.get('setkeys') and not (added or removed):
+        changes['setkeys'] = (old.get('setkeys'), new.get('setkeys'))
+
+    return changes
+
+
+def _diff_parsed(old, new, oldhashes, newhashes):
+    oldnames = set(oldhashes)
+    newnames = set(newhashes)
+
+    changed = {}
+    for name in sorted(oldnames & newnames):
+        if oldhashes[name] != newhashes[name]:
+            changed[name] = _diff_msid(old[name], new[name])
+
+    metadata = {}
+    for key in _spec_keys:
+        if old.get(key) != new.get(key):
+            metadata[key] = (old.get(key), new.get(key))
+
+    return {'added': sorted(newnames - oldnames),
+            'removed': sorted(oldnames - newnames),
+            'changed': changed,
+            'metadata': metadata}
+
+
+def diff_glimmon(old, new, cache=None):
+    """ Compare two revisions of a GRETA limit monitoring specification.
+
+    :param old: Older specification, either a dictionary returned by read_glimmon or a file name
+    :param new: Newer specification, either a dictionary returned by read_glimmon or a file name
+    :param cache: ParseCache used to read file names, defaults to the default parse cache
+
+    :returns: Dictionary of differences
+
+    The returned dictionary has the following keys:
+
+      - 'added': Sorted list of mnemonics only in the new specification
+      - 'removed': Sorted list of mnemonics only in the old specification
+      - 'changed': Dictionary keyed by mnemonic of the differences for mnemonics in both
+        specifications. Changes to 'type', 'default', 'mlmtol', 'mlimsw', and 'mlmenable' are
+        recorded as (old, new) tuples, limit sets that were added or removed are listed under
+        'sets_added' and 'sets_removed', and limit sets that were modified are listed under
+        'sets_changed' with 'old' and 'new' definitions.
+      - 'metadata': Dictionary of (old, new) tuples for changes to the revision, version,
+        database, mlmdeftol, and mlmthrow values.
+
+    """
+
+    cache = cache if cache is not None else default_cache
+    old = _load(old, cache)
+    new = _load(new, cache)
+
+    return _diff_parsed(old, new, _spec_hashes(old), _spec_hashes(new))
+
+
+def _revision_key(filename, glimmon):
+    revision = glimmon.get('revision', '')
+    try:
+        number = tuple(int(part) for part in revision.split('.'))
+    except ValueError:
+        number = ()
+    return (number, os.path.getmtime(filename), filename)
+
+
+def diff_glimmon_dir(directory, pattern='G_LIMMON*.dec', cache=None):
+    """ Compare each revision of a specification in a directory with the previous revision.
+
+    :param directory: Directory containing specification files, one file per revision
+    :param pattern: Glob pattern used to select specification files within the directory
+    :param cache: ParseCache used to read the files, defaults to the default parse cache
+
+    :returns: List of (oldfile, newfile, differences) tuples, see diff_glimmon
+
+    Files are ordered by their $Revision$ number, then by modification time. Each file is parsed
+    and hashed only once.
+
+    """
+
+    cache = cache if cache is not None else default_cache
+    filenames = glob.glob(os.path.join(directory, pattern))
+
+    specs = [(filename, cache.read_glimmon(filename)) for filename in filenames]
+    specs.sort(key=lambda spec: _revision_key(*spec))
+    hashes = [_spec_hashes(glimmon) for filename, glimmon in specs]
+
+    diffs = []
+    for n in range(1, len(specs)):
+        (oldfile, old), (newfile, new) = specs[n - 1], specs[n]
+        diffs.append((oldfile, newfile, _diff_parsed(old, new, hashes[n - 1], hashes[n])))
+
+    return diffs
@@ -1,17 +1,59 @@
 
-import numpy as np
+import glob
+import multiprocessing
+import os
 import re
 
-import Ska.engarchive.fetch_eng as fetch_eng
-from Chandra.Time import DateTime
+import numpy as np
 
-def read_glimmon(filename='/home/greta/AXAFSHARE/dec/G_LIMMON.dec'):
+from .limlog import LimitLog, _line_batches
+from .profiling import _profiled, _stage, _count
+
+
+# Patterns used by read_glimmon, compiled once at import time rather than once per line
+_revision_pattern = re.compile('^#\$Revision\s*:\s*([0-9.]+).*$')
+_version_pattern = re.compile('.*Version\s*:\s*[$]?([A-Za-z0-9.: \t]*)[$]?"\s*$')
+_database_pattern = re.compile('.*Database\s*:\s*(\w*)"\s*$')
+_version_line = re.compile('^XMSID TEXTONLY ROWCOL.*COLOR.*Version')
+_database_line = re.compile('^XMSID TEXTONLY ROWCOL.*COLOR.*Database')
+
+# Keywords of interest within an MLIMIT line
+_mlimit_keywords = ('DEFAULT', 'SWITCHSTATE', 'PPENG', 'EXPST')
+
+# Patterns used by parse_comments
+_comment_start = re.compile('(#\s+([0|1]\d-\d\d-20\d\d)\s+(\w+\s+\w+)\s+(.*))')
+_comment_end = '#' + '=' * 75
+_detail_start = re.compile('#\s+(MSID)?From:?\s+To:?\s*\w*:?')
+_change_pattern = re.compile('#\s+(\w+):?\s*' + '(\w+\s\w*)\s*[=,:]?\s*' + '([0-9fFcC.-]+)\s*' +
+                             '(\w+\s\w*)\s*[=,:]?\s*' + '([0-9fFcC.-]+)\s*' + '(.*)')
+_message_continuation = re.compile('\s*\n#\s+')
+
+# Keywords read by parse_decplot for each section of a dec plot file, with their data type and
+# whether the value is split into a list
+_display_keywords = {'DTITLE': (str, False), 'DSUBTITLE': (str, False), 'DTYPE': (str, True),
+                     'DXAXIS': (float, True)}
+_plot_keywords = {'PTRACES': (int, False), 'PBILEVELS': (int, False), 'PTITLE': (str, False),
+                  'PYLABEL': (str, False), 'PGRID': (int, False), 'PLEGEND': (int, False),
+                  'PYAXIS': (float, True), 'PYAUTO': (int, False)}
+_trace_keywords = {'TMSID': (str, False), 'TNAME': (str, False), 'TCOLOR': (str, False),
+                   'TCALC': (str, False), 'TSTAT': (str, False)}
+_bilevel_keywords = {'TMSID': (str, False), 'TNAME': (str, False), 'TCOLOR': (str, False)}
+_section_number = re.compile('\s+(\d+)')
+
+# Column names used for the columnar (NumPy array) form of a limit specification
+_limit_columns = ('warning_low', 'caution_low', 'caution_high', 'warning_high')
+
+
+@_profiled('read_glimmon')
+def read_glimmon(filename='/home/greta/AXAFSHARE/dec/G_LIMMON.dec', columnar=False):
     """ Read G_LIMMON.dec format file
 
     Reads in a G_LIMMON.dec or any other GRETA limit monitor specification file, such as
     G_LIMMON_SAFEMODE.dec, and returns a dictionary containing the contents of the file.
     
     :param filename: File name of GRETA limit monitoring specification file
+    :param columnar: If True, return the limit sets as a dictionary of NumPy arrays (see
+                     glimmon_to_columns) rather than the nested dictionary
 
     :returns: Dictionary containing the GRETA limit monitoring specifcation 
 
@@ -25,208 +67,337 @@ def read_glimmon(filename='/home/greta/AXAFSHARE/dec/G_LIMMON.dec'):
     mnemonics are included in the Ska engineering archive.
 
     """
-    revision_pattern = '^#\$Revision\s*:\s*([0-9.]+).*$'
-    version_pattern = '.*Version\s*:\s*[$]?([A-Za-z0-9.: \t]*)[$]?"\s*$'
-    database_pattern = '.*Database\s*:\s*(\w*)"\s*$'
-
-    # Read the GLIMMON.dec file and store each line in "gfile"
-    with open(filename, 'r') as fid:
-        gfile = fid.readlines()
 
     # Initialize the glimmon dictionary
     glimmon = {}
 
-    # Step through each line in the GLIMMON.dec file
-    for line in gfile:
+    # Step through each line in the GLIMMON.dec file, only one pass is made through the file
+    linenum = -1
+    with _stage('parse'), open(filename, 'r') as fid:
+        for linenum, line in enumerate(fid):
 
-        # Assume the line uses whitespace as a delimiter
-        words = line.split()
+            # Assume the line uses whitespace as a delimiter
+            words = line.split()
+
+            if not words:
+                continue
 
-        if words:
             # Only process lines that begin with MLOAD, MLIMIT, MLMTOL, MLIMSW, MLMENABLE,
             # MLMDEFTOL, or MLMTHROW. This means that all lines with equations are
             # omitted; we are only interested in the limits and expected states
+            keyword = words[0]
 
-            if words[0] == 'MLOAD':
+            if keyword == 'MLOAD':
                 name = words[1]
-                glimmon.update({name:{}})
+                glimmon[name] = {}
 
-            elif words[0] == 'MLIMIT':
+            elif keyword == 'MLIMIT':
                 setnum = int(words[2])
-                glimmon[name].update({setnum:{}})
-                if glimmon[name].has_key('setkeys'):
+                limitset = {}
+                glimmon[name][setnum] = limitset
+                if 'setkeys' in glimmon[name]:
                     glimmon[name]['setkeys'].append(setnum)
                 else:
                     glimmon[name]['setkeys'] = [setnum,]
 
-                if 'DEFAULT' in words:
-                    glimmon[name].update({'default':setnum})
+                # Record the position of the first occurrence of each keyword in one pass
+                position = {}
+                for ind, word in enumerate(words):
+                    if word in _mlimit_keywords and word not in position:
+                        position[word] = ind
+
+                if 'DEFAULT' in position:
+                    glimmon[name]['default'] = setnum
+
+                if 'SWITCHSTATE' in position:
+                    ind = position['SWITCHSTATE']
+                    limitset['switchstate'] = words[ind + 1]
 
-                if 'SWITCHSTATE' in words:
-                    ind = words.index('SWITCHSTATE')
-                    glimmon[name][setnum].update({'switchstate':words[ind+1]})
+                if 'PPENG' in position:
+                    ind = position['PPENG']
+                    glimmon[name]['type'] = 'limit'
+                    limitset['warning_low'] = float(words[ind + 1])
+                    limitset['caution_low'] = float(words[ind + 2])
+                    limitset['caution_high'] = float(words[ind + 3])
+                    limitset['warning_high'] = float(words[ind + 4])
 
-                if 'PPENG' in words:
-                    ind = words.index('PPENG')
-                    glimmon[name].update({'type':'limit'})
-                    glimmon[name][setnum].update({'warning_low':
-                                                  float(words[ind + 1])})
-                    glimmon[name][setnum].update({'caution_low':
-                                                  float(words[ind + 2])})
-                    glimmon[name][setnum].update({'caution_high':
-                                                  float(words[ind + 3])})
-                    glimmon[name][setnum].update({'warning_high':
-                                                  float(words[ind + 4])})
+                if 'EXPST' in position:
+                    ind = position['EXPST']
+                    glimmon[name]['type'] = 'expected_state'
+                    limitset['expst'] = words[ind + 1]
 
-                if 'EXPST' in words:
-                    ind = words.index('EXPST')
-                    glimmon[name].update({'type':'expected_state'})
-                    glimmon[name][setnum].update({'expst':words[ind + 1]})
+            elif keyword == 'MLMTOL':
+                glimmon[name]['mlmtol'] = int(words[1])
 
-            elif words[0] == 'MLMTOL':
-                glimmon[name].update({'mlmtol':int(words[1])})
+            elif keyword == 'MLIMSW':
+                glimmon[name]['mlimsw'] = words[1]
 
-            elif words[0] == 'MLIMSW':
-                glimmon[name].update({'mlimsw':words[1]})
+            elif keyword == 'MLMENABLE':
+                glimmon[name]['mlmenable'] = int(words[1])
 
-            elif words[0] == 'MLMENABLE':
-                glimmon[name].update({'mlmenable':int(words[1])})
+            elif keyword == 'MLMDEFTOL':
+                glimmon['mlmdeftol'] = int(words[1])
 
-            elif words[0] == 'MLMDEFTOL':
-                glimmon.update({'mlmdeftol':int(words[1])})
+            elif keyword == 'MLMTHROW':
+                glimmon['mlmthrow'] = int(words[1])
 
-            elif words[0] == 'MLMTHROW':
-                glimmon.update({'mlmthrow':int(words[1])})
+            elif keyword == 'XMSID':
+                if _version_line.match(line):
+                    version = _version_pattern.findall(line)
+                    glimmon['version'] = version[0].strip()
 
-            elif len(re.findall('^XMSID TEXTONLY ROWCOL.*COLOR.*Version', line)) > 0:
-                version = re.findall(version_pattern, line)
-                glimmon.update({'version':version[0].strip()})
+                elif _database_line.match(line):
+                    database = _database_pattern.findall(line)
+                    glimmon['database'] = database[0].strip()
 
-            elif len(re.findall('^XMSID TEXTONLY ROWCOL.*COLOR.*Database', line)) > 0:
-                database = re.findall(database_pattern, line)
-                glimmon.update({'database':database[0].strip()})
+            elif line.startswith('#$Revision'):
+                revision = _revision_pattern.findall(line)
+                glimmon['revision'] = revision[0].strip()
 
-            elif len(re.findall('^#\$Revision', line)) > 0:
-                revision = re.findall(revision_pattern, line)
-                glimmon.update({'revision':revision[0].strip()})
+    _count('lines', linenum + 1)
 
+    if columnar:
+        with _stage('columns'):
+            return glimmon_to_columns(glimmon)
 
     return glimmon
 
 
-def parse_comments(filename='/home/greta/AXAFSHARE/dec/G_LIMMON.dec', startline=603):
-    """ Parse the comment section near the top of a G_LIMMON.dec file.
+def glimmon_to_columns(glimmon):
+    """ Convert a limit monitoring specification into columnar NumPy arrays.
 
-    :param filename: File name of GRETA limit monitoring specification file
-    :param startline: The line at which the comments began to follow a predictable form, similar
-                      to the format described below.
+    :param glimmon: Dictionary returned by read_glimmon
 
-    :returns: Dictionary containing parsed comments, keys are the times associated with each
-              comment in the format returned by Chandra.Time.DateTime().sec.
+    :returns: Dictionary of equal length NumPy arrays with one row per limit set
 
-    This relies upon the user editing the G_LIMMON.dec file for each revision to adhere to the
-    following format:
+    The returned columns are 'msid', 'setnum', 'warning_low', 'caution_low', 'caution_high',
+    'warning_high', 'switchstate', 'expst', and 'default'. Limits that are not defined in the
+    specification are set to NaN, undefined switch or expected states are set to an empty
+    string, and 'default' is True for the default limit set of each mnemonic. Rows are sorted
+    by mnemonic name and then by the order in which the limit sets appear in the file.
 
-    #   09-25-2012  Firstname Lastname Message, can be one or more lines.
-    #
-    #                  From                      To                      Description
-    #         MSID1    LIMIT_TYPE=  Orig_Number  LIMIT_TYPE= New_Number  Description (in one line)
-    #         MSID2    LIMIT_TYPE=  Orig_Number  LIMIT_TYPE= New_Number  Description (in one line)
-    #         MSID3    LIMIT_TYPE=  Orig_Number  LIMIT_TYPE= New_Number  Description (in one line)
+    Limit checks can then be performed on all limit sets at once, for example:
 
-    At this time, this function only processes limit changes, expected state changes are not
-    processed. The ability to parse expected state changes may be added in the future.
+        cols = glimmon_to_columns(read_glimmon())
+        bad = (values < cols['warning_low']) | (values > cols['warning_high'])
 
     """
 
+    msids = []
+    setnums = []
+    limits = dict((col, []) for col in _limit_columns)
+    switchstates = []
+    expsts = []
+    defaults = []
+
+    for name in sorted(glimmon.keys()):
+        entry = glimmon[name]
+        if not isinstance(entry, dict):
+            continue
+
+        for setnum in entry.get('setkeys', []):
+            limitset = entry[setnum]
+            msids.append(name)
+            setnums.append(setnum)
+            for col in _limit_columns:
+                limits[col].append(limitset.get(col, np.nan))
+            switchstates.append(limitset.get('switchstate', ''))
+            expsts.append(limitset.get('expst', ''))
+            defaults.append(entry.get('default') == setnum)
+
+    columns = {'msid': np.array(msids, dtype=str),
+               'setnum': np.array(setnums, dtype=np.int32),
+               'switchstate': np.array(switchstates, dtype=str),
+               'expst': np.array(expsts, dtype=str),
+               'default': np.array(defaults, dtype=bool)}
+    for col in _limit_columns:
+        columns[col] = np.array(limits[col], dtype=np.float64)
+
+    return columns
+
+
+def _comment_blocks(filename, startline):
+    """ Split the comment section of a G_LIMMON.dec file into one block per revision entry.
+
+    :returns: List of (date, name, text) tuples in the order they appear in the file
+
+    Each block starts at the revision header (date and name) and ends at the start of the next
+    header, or at the line of '=' characters that ends the comment section. Headers found after
+    the end of the comment section are returned with empty text.
+    """
+
+    blocks = []
+    current = None
+    ended = False
+    linenum = -1
+
     with open(filename, 'r') as fid:
-        gfile = fid.readlines()
+        for linenum, line in enumerate(fid):
+            if linenum < startline:
+                continue
+
+            if not ended:
+                end = line.find(_comment_end)
+                if end >= 0:
+                    if current is not None:
+                        current[2].append(line[:end])
+                    ended = True
+                    continue
 
-    # Start at a point in the comments when they followed a predictable form
-    s = ''.join(gfile[startline:])
+            header = _comment_start.search(line)
+            if header:
+                if current is not None and not ended:
+                    current[2].append(line[:header.start()])
+                current = (header.group(2), header.group(3), [])
+                if not ended:
+                    current[2].append(line[header.start():])
+                blocks.append(current)
 
-    commentstart = '(#\s+([0|1]\d-\d\d-20\d\d)\s+(\w+\s+\w+)\s+(.*))'
+            elif current is not None and not ended:
+                current[2].append(line)
 
-    r = re.findall(commentstart, s)
+    _count('lines', linenum + 1)
 
-    start = [s.find(m[0]) for m in r]
-    start.append(s.find('#' + '=' * 75))
-    dates = [m[1] for m in r]
-    names = [m[2] for m in r]
-    text = [s[start[n]:start[n+1]] for n in range(len(start)-1)]
+    return [(date, name, ''.join(text)) for date, name, text in blocks]
 
-    def add_changes(t, d):
 
-        msid = '#\s+(\w+):?\s*'
-        vtype = '(\w+\s\w*)\s*[=,:]?\s*'
-        val = '([0-9fFcC.-]+)\s*'
-        dval = '(.*)'
-        changelistpattern = (msid + vtype + val + vtype + val + dval)
+def _comment_changes(t, d):
+    """ Parse the limit change table that follows the column headings in a comment block.
+    """
 
-        # I'm splitting this because regex .* is not behaving as expected with
-        # newlines. Operating on a line by line basis is therefore more robust.
-        details = t[d.end():].split('\n')
+    # I'm splitting this because regex .* is not behaving as expected with
+    # newlines. Operating on a line by line basis is therefore more robust.
+    details = t[d.end():].split('\n')
 
-        changedict = {}
-        for line in details:
-            changes = re.findall(changelistpattern, line)
+    changedict = {}
+    for line in details:
+        changes = _change_pattern.findall(line)
 
-            if changes:
+        if changes:
 
-                msid = changes[0][0].lower()
-                changetype = changes[0][1].lower()
-                oldval = changes[0][2]
-                newval = changes[0][4]
-                description = changes[0][5]
+            msid = changes[0][0].lower()
+            changetype = changes[0][1].lower()
+            oldval = changes[0][2]
+            newval = changes[0][4]
+            description = changes[0][5]
 
-                if msid not in changedict.keys():
-                    changedict.update({msid:{}})
+            if msid not in changedict:
+                changedict[msid] = {}
 
-                if changetype not in changedict[msid].keys():
-                    changedict[msid].update({changetype:{}})
+            if changetype not in changedict[msid]:
+                changedict[msid][changetype] = {}
 
-                changedict[msid][changetype].update(
-                    {'old':oldval, 'new':newval, 'description':description})
+            changedict[msid][changetype].update(
+                {'old':oldval, 'new':newval, 'description':description})
 
-        return changedict
+    return changedict
 
-    glimmonchanges = {}
-    for date, name, t in zip(dates, names, text):
 
-        datestr = date[6:] + '-' + date[:2] + '-' + date[3:5]
-        datesec = DateTime(datestr).secs
+def _comment_entries(filename='/home/greta/AXAFSHARE/dec/G_LIMMON.dec', startline=603):
+    """ Parse the comment section of a G_LIMMON.dec file into a list of revision entries.
 
-        detailstart = '#\s+(MSID)?From:?\s+To:?\s*\w*:?'
-        d = re.search(detailstart, t, re.IGNORECASE & re.DOTALL)
+    :returns: List of dictionaries with 'secs', 'date', 'name', 'message', and 'changes' keys,
+              in the order they appear in the file (see parse_comments)
+    """
 
-        messagestart = t.find(name) + len(name)
+    # Imported here so that read_glimmon and parse_decplot can be used without the Ska
+    # environment, and without paying its import cost
+    from Chandra.Time import DateTime
 
-        if d:
-            message = t[messagestart:(d.start()-1)].strip()
-            changedict = add_changes(t, d)
+    with _stage('read'):
+        blocks = _comment_blocks(filename, startline)
 
-        else:
-            message = t[messagestart:].strip()
-            changedict = {}
+    with _stage('datetime'):
+        dtimes = [DateTime(date[6:] + '-' + date[:2] + '-' + date[3:5])
+                  for date, name, t in blocks]
+
+    with _stage('regex'):
+        entries = [_comment_entry(dtime, name, t)
+                   for dtime, (date, name, t) in zip(dtimes, blocks)]
+
+    _count('entries', len(entries))
+
+    return entries
+
+
+def _comment_entry(dtime, name, t):
+    """ Parse the message and limit changes of one comment block.
+    """
+
+    d = _detail_start.search(t)
+
+    messagestart = t.find(name) + len(name)
+
+    if d:
+        message = t[messagestart:(d.start()-1)].strip()
+        changedict = _comment_changes(t, d)
 
-        message = re.sub('\s*\n#\s+', ' ', message)
-        message = re.sub('\n#', '', message)
+    else:
+        message = t[messagestart:].strip()
+        changedict = {}
+
+    message = _message_continuation.sub(' ', message)
+    message = message.replace('\n#', '')
+
+    return {'secs':dtime.secs,
+            'date':dtime.date,
+            'name':name,
+            'message':message,
+            'changes':changedict}
+
+
+@_profiled('parse_comments')
+def parse_comments(filename='/home/greta/AXAFSHARE/dec/G_LIMMON.dec', startline=603):
+    """ Parse the comment section near the top of a G_LIMMON.dec file.
 
-        glimmonchanges[datesec] = {'date':DateTime(datestr).date,
-                                   'name':name,
-                                   'message':message,
-                                   'changes':changedict}
+    :param filename: File name of GRETA limit monitoring specification file
+    :param startline: The line at which the comments began to follow a predictable form, similar
+                      to the format described below.
+
+    :returns: Dictionary containing parsed comments, keys are the times associated with each
+              comment in the format returned by Chandra.Time.DateTime().sec.
+
+    This relies upon the user editing the G_LIMMON.dec file for each revision to adhere to the
+    following format:
+
+    #   09-25-2012  Firstname Lastname Message, can be one or more lines.
+    #
+    #                  From                      To                      Description
+    #         MSID1    LIMIT_TYPE=  Orig_Number  LIMIT_TYPE= New_Number  Description (in one line)
+    #         MSID2    LIMIT_TYPE=  Orig_Number  LIMIT_TYPE= New_Number  Description (in one line)
+    #         MSID3    LIMIT_TYPE=  Orig_Number  LIMIT_TYPE= New_Number  Description (in one line)
+
+    At this time, this function only processes limit changes, expected state changes are not
+    processed. The ability to parse expected state changes may be added in the future.
+
+    The file is read in a single pass. When more than one entry has the same date, only the
+    last is returned; use LimitHistory to access every entry.
+
+    """
+
+    glimmonchanges = {}
+    for entry in _comment_entries(filename, startline):
+        glimmonchanges[entry['secs']] = {'date':entry['date'],
+                                         'name':entry['name'],
+                                         'message':entry['message'],
+                                         'changes':entry['changes']}
 
     return glimmonchanges
 
 
-def process_limits_file(filename='limfile.txt'):
+@_profiled('process_limits_file')
+def process_limits_file(filename='limfile.txt', metadata=None, compact=False):
     ''' Process the limit file generated using a G_LIMMON.dec type of specification.
 
     This processes the output of G_LIMMON or any other GRETA limit monitoring specification and
     calculates relevant statistics. 
 
     :param filename: File name of G_LIMMON output file
+    :param metadata: Metadata provider used to look up mnemonic owners and descriptions (see
+                     tdbmeta), defaults to the Ska telemetry database
+    :param compact: If True, the out of state values for each mnemonic ('statelog') are
+                    recorded in a run-length encoded StateLog rather than a list, use
+                    expand_limlog to convert the result to the legacy format
 
     :returns: Dictionary of limit violations and relevant statistics.
 
@@ -234,162 +405,85 @@ def process_limits_file(filename='limfile.txt'):
     safemodes, normal sun modes, or any other special condition that may result in corrupted
     telemetry.
 
+    The file is read and processed in batches of lines, so memory use does not grow with the
+    size of the file, other than through the out of state logs.
+
     '''
 
+    limits = LimitLog(metadata=metadata, compact=compact)
+
     # Load the greta limit file
-    infile = open(filename,'r')
-    limlines = infile.readlines()
-    infile.close()
+    with open(filename, 'r') as infile:
+        batches = _line_batches(infile)
+        while True:
+            with _stage('read'):
+                limlines = next(batches, None)
+            if limlines is None:
+                break
+            limits.update(limlines)
 
-    limlog = {}
+    return limits.limlog
 
-    for line in limlines:
-        words = line.split()
 
-        if words:
-            tstring = DateTime(words[0],'greta').date
-            msid = words[2]
-            msg = words[3]
-            currentval = words[4]
+class _DecScope(object):
+    """ Collect the first value of each keyword within one section of a GRETA dec plot file.
 
-            try:
-                fetchobj = fetch.Msid(msid, start='2001:001:00:00:00', stop='2001:001:00:05:00')
-                owner = fetchobj.tdb.owner_id
-                description = fetchobj.tdb.technical_name
-
-            except:
-                owner = 'Not Known'
-                description = 'Not Known'
-
-            # There should be 5 columns for a return to NOMINAL and 7 colums
-            # for a violation. In cases where data gets corrupted for whatever
-            # reason, the current value can be left blank. When this gets left
-            # blank, treat this as a violation but assign 'none' as the current
-            # value.
-
-            if len(words) == 7:
-                opr = words[5]
-                lim = words[6]
-
-            elif len(words) == 6:
-                currentval = 'none'
-                opr = words[4]
-                lim = words[5]
-
-            # if the current value is equal to none, then skip this
-            # line in the limits file
-            if currentval != 'none':
-
-                if limlog.has_key(msid):
-
-                    if limlog[msid].has_key('firstviolation'):
-
-                        # if it is nominal, then increase the toggle count
-                        if words[3] == 'NOMINAL':
-                            limlog[msid]['num'] = limlog[msid]['num'] + 1
-                            limlog[msid].update({'endtime':tstring})
-
-                        # if it is not nominal, then all you need to worry
-                        # about is determining what the worst violation type
-                        # is. This assumes that an msid won't cross a high and
-                        # low limit in the same period over which this script
-                        # is run.
-                        else:
-
-                            # The following if-else statement will not return
-                            # return correct results if both a high and a low
-                            # limit violation occurs in the same file. This
-                            # would only be likely to happen if the telemetry
-                            # stream were corrupt.
-                            if 'WARNING' in msg:
-                                maxval = np.max([float(currentval), limlog[msid]['max']])
-                                minval = np.min([float(currentval), limlog[msid]['min']])
-                                limlog[msid]['worsttype'] = msg
-                                limlog[msid]['max'] = maxval
-                                limlog[msid]['min'] = minval
-                                limlog[msid]['limit'] = lim
-
-                            elif 'CAUTION' in msg:
-                                maxval = np.max([float(currentval), limlog[msid]['max']])
-                                minval = np.min([float(currentval), limlog[msid]['min']])
-
-                                if limlog[msid].has_key('worsttype'):
-
-                                    if 'WARNING' not in limlog[msid]['worsttype']:
-                                        limlog[msid]['worsttype'] = msg
-                                        limlog[msid]['limit'] = lim
-                                else:
-                                    limlog[msid]['worsttype'] = msg
-                                    limlog[msid]['limit'] = lim
-
-                                limlog[msid]['max'] = maxval
-                                limlog[msid]['min'] = minval
-
-                            else:
-                                # Then this must be an out of state violation
-                                limlog[msid]['worsttype'] = msg
-                                limlog[msid]['statelog'].append(currentval)
-
-                                # use same name as limits for simplicity
-                                limlog[msid]['limit'] = lim
-
-                    # In this case, an msid has already been recorded, but
-                    # without a first violation, which means it must have been
-                    # a return to nominal (since this msid already has an
-                    # entry)
-                    else:
-
-                        if msg == 'OUT-OF-STATE':
-                            limlog[msid].update({'statelog':[currentval]})
-                            limlog[msid].update({'initialvalue':currentval})
-                            limlog[msid].update({'limit':lim})
-                            limlog[msid].update({'firstviolation':tstring})
-                            limlog[msid].update({'worsttype':msg})
-
-                        elif msg == 'NOMINAL':
-                            # do nothing, this is a repeat return to nominal
-                            junk = 9
-
-                        else:
-                            limlog[msid].update({'max':float(currentval)})
-                            limlog[msid].update({'min':float(currentval)})
-                            limlog[msid].update({'initialvalue': float(currentval)})
-                            limlog[msid].update({'limit':float(lim)})
-                            limlog[msid].update({'firstviolation':tstring})
-                            limlog[msid].update({'worsttype':msg})
+    A keyword followed only by whitespace takes its value from the next non-blank line in the
+    section, matching the behavior of a multiline regular expression search of the section.
+    """
 
-                else:
-                    limlog.update({msid:{}})
-                    limlog[msid].update({'owner':owner})
-                    limlog[msid].update({'description':description})
+    def __init__(self, keywords):
+        self.keywords = keywords
+        self.values = {}
+        self.pending = []
+
+    def feed(self, line, keyword, value):
+        if self.pending and line.strip():
+            for key in self.pending:
+                self.values[key] = line.lstrip().rstrip('\n')
+            self.pending = []
+
+        if keyword in self.keywords and keyword not in self.values:
+            self.values[keyword] = value
+            if not value:
+                self.pending.append(keyword)
+
+    def close(self):
+        for key in self.pending:
+            self.values[key] = ''
+        self.pending = []
+
+    def get(self, keyword):
+        """ Return the value of a keyword converted to its data type, or None if not found.
+        """
+        rval = self.values.get(keyword)
+        if rval is None:
+            return None
 
-                    if words[3] != 'NOMINAL': # if NOT nominal
-                        limlog[msid].update({'firstviolation':tstring})
-                        limlog[msid].update({'worsttype':msg})
-                        limlog[msid].update({'num':0})
+        rtype, split = self.keywords[keyword]
+        if split:
+            rval = rval.split()
+            return [rtype(val) for val in rval] if rtype is not str else rval
+        return rtype(rval) if rtype is not str else rval.strip()
 
-                        if msg == 'OUT-OF-STATE':
-                            limlog[msid].update({'statelog':[currentval]})
-                            limlog[msid].update({'initialvalue':currentval})
-                            limlog[msid].update({'limit':lim})
-                        else:
-                            limlog[msid].update({'max':float(currentval)})
-                            limlog[msid].update({'min':float(currentval)})
-                            limlog[msid].update({'initialvalue': float(currentval)})
-                            limlog[msid].update({'limit':float(lim)})
 
-                    else:
-                        limlog[msid].update({'num':0})
-                        limlog[msid].update({'comment':'return to nominal ' 
-                                             + 'is observed before violation'})
+def _dec_tokenize(line):
+    """ Return the keyword at the start of a line and the text that follows it.
+
+    Lines that begin with whitespace, or where the first word is not followed by whitespace,
+    do not start with a keyword and return (None, None).
+    """
+    if not line or line[0].isspace():
+        return None, None
 
-            else:
-                print 'Skipped this line in the limits file due to missing value:\n{}\n'\
-                      .format(line)
+    keyword = line.split(None, 1)[0]
+    if len(line) == len(keyword):
+        return None, None
 
-    return limlog
+    return keyword, line[len(keyword):].lstrip().rstrip('\n')
 
 
+@_profiled('parse_decplot')
 def parse_decplot(decfile):
     """Parse a GRETA dec plot file to extract plotting data.
 
@@ -398,107 +492,141 @@ def parse_decplot(decfile):
     :returns: dictionary of plot specification details
 
     This will not parse text display data (e.g. FMAIN.dec) or equations.
-    """
-
-    def finddecstring(pattern, string, rtype='string', split=False):
-        """Search a single line in a GRETA dec file for plotting information.
-
-        :param pattern: The name of the GRETA keyword
-        :param strin: The string to be searched
-        :param rtype: The returned data type (currently string, int, or float)
-        :param split" Flag to allow the user to request the returned data be split into a list
-
-        :returns: String for requested plotting information
-
-        """
-
-        rtype = str(rtype).lower()
-        p1 = re.compile('^' + pattern + '\s+(.*)$', re.MULTILINE)
-        r = p1.search(string)
-        rval = None
-
-        if not isinstance(r, type(None)):
-            rval = r.group(1)
-            if split:
-                rval = rval.split()
-            if rtype == 'string':
-                if split:
-                    rval = [val.strip() for val in rval]
-                else:
-                    rval = rval.strip()
-            if rtype=='float':
-                if split:
-                    rval = [float(n) for n in rval]
-                else:
-                    rval = float(rval)
-            if rtype=='int':
-                if split:
-                    rval = [int(n) for n in rval]
-                else:
-                    rval = int(rval)
-        
-        return rval
 
+    The file is read in a single pass. Plot (PINDEX) sections run until the next PINDEX line,
+    trace (TINDEX) and bilevel trace (TBLINDEX) sections run until the next section of the same
+    kind or the end of the plot, and each keyword takes the first value found in its section.
+    """
 
-    infile = open(decfile,'rb')
-    body = infile.read()
-    infile.close()
+    display = _DecScope(_display_keywords)
+    plots = []
+    scopes = [display]
+    linenum = -1
+
+    with _stage('parse'), open(decfile, 'r') as fid:
+        for linenum, line in enumerate(fid):
+
+            # Section markers must start a line, and PINDEX must follow a newline
+            if linenum > 0 and line.startswith('PINDEX'):
+                for scope in scopes[1:]:
+                    scope.close()
+                num = int(_section_number.match(line[6:]).group(1))
+                plot = (num, _DecScope(_plot_keywords), [], [])
+                plots.append(plot)
+                scopes = [display, plot[1]]
+                trace = bilevel = None
+
+            elif plots and line.startswith('TINDEX'):
+                if trace is not None:
+                    trace[1].close()
+                    scopes.remove(trace[1])
+                tnum = int(_section_number.match(line[6:]).group(1))
+                trace = (tnum, _DecScope(_trace_keywords))
+                plot[2].append(trace)
+                scopes.append(trace[1])
+
+            elif plots and line.startswith('TBLINDEX'):
+                if bilevel is not None:
+                    bilevel[1].close()
+                    scopes.remove(bilevel[1])
+                tbnum = int(_section_number.match(line[8:]).group(1))
+                bilevel = (tbnum, _DecScope(_bilevel_keywords))
+                plot[3].append(bilevel)
+                scopes.append(bilevel[1])
+
+            keyword, value = _dec_tokenize(line)
+            for scope in scopes:
+                scope.feed(line, keyword, value)
+
+    for scope in scopes:
+        scope.close()
+
+    _count('lines', linenum + 1)
+    _count('plots', len(plots))
+
+    with _stage('build'):
+        return _build_decplot(display, plots)
+
+
+def _build_decplot(display, plots):
+    """ Assemble the parse_decplot output from the parsed display and plot sections.
+    """
 
     decplots = {}
 
-    decplots['DTITLE'] = finddecstring('DTITLE', body)
-    decplots['DSUBTITLE'] = finddecstring('DSUBTITLE', body)
-    decplots['DTYPE'] = finddecstring('DTYPE', body, split=True)
+    decplots['DTITLE'] = display.get('DTITLE')
+    decplots['DSUBTITLE'] = display.get('DSUBTITLE')
+    decplots['DTYPE'] = display.get('DTYPE')
     decplots['DTYPE'][1] = int(decplots['DTYPE'][1])
-    xdata = finddecstring('DXAXIS', body, rtype='float', split=True)
+    xdata = display.get('DXAXIS')
     decplots['DXAXIS'] = [60*d for d in xdata]
 
-    r = re.split('\nPINDEX',body) # Newline excludes commented out plots
-    decplots['numplots'] = len(r)-1
-    plots = {}
-    for plotdef in r[1:]:
-        num = int(re.match('\s+(\d+)[.\n]*', plotdef).group(1))
-        plots[num] = {}
-        plots[num]['PINDEX'] = num
-        plots[num]['PTRACES'] = finddecstring('PTRACES', plotdef, rtype='int')
-        plots[num]['PBILEVELS'] = finddecstring('PBILEVELS', plotdef, rtype='int')
-        plots[num]['PTITLE'] = finddecstring('PTITLE', plotdef)
-        plots[num]['PYLABEL'] = finddecstring('PYLABEL', plotdef)
-        plots[num]['PGRID'] = finddecstring('PGRID', plotdef, rtype='int')
-        plots[num]['PLEGEND'] = finddecstring('PLEGEND', plotdef, rtype='int')
-        plots[num]['PYAXIS'] = finddecstring('PYAXIS', plotdef, rtype='float', split=True)
-        plots[num]['PYAUTO'] = finddecstring('PYAUTO', plotdef, rtype='int')
-
-        # Cycle through all TINDEX in a similar way to how you cycle through
-        # PINDEX
-        t = re.split('\nTINDEX',plotdef) # Newline excludes commented out msids
+    decplots['numplots'] = len(plots)
+    plotdict = {}
+    for num, plotdef, tracedefs, tbtracedefs in plots:
+        plotdict[num] = {'PINDEX': num}
+        for keyword in _plot_keywords:
+            plotdict[num][keyword] = plotdef.get(keyword)
+
         traces = {}
-        for tracedef in t[1:]:
-            tnum = int(re.match('\s+(\d+)[.\n]*', tracedef).group(1))
-            traces[tnum] = {}
-            traces[tnum]['TINDEX'] = tnum
-            traces[tnum]['TMSID'] = finddecstring('TMSID', tracedef)
-            traces[tnum]['TNAME'] = finddecstring('TNAME', tracedef)
-            traces[tnum]['TCOLOR'] = finddecstring('TCOLOR', tracedef)
-            traces[tnum]['TCALC'] = finddecstring('TCALC', tracedef)
-            traces[tnum]['TSTAT'] = finddecstring('TSTAT', tracedef)
-        plots[num]['traces'] = traces
-
-        # TBLINDEX - do this separate in case they are intermingled with
-        # TINDEX definitions
-        tb = re.split('\nTBLINDEX',tracedef) # Newline excludes comments
-        if len(tb) > 1:
+        for tnum, tracedef in tracedefs:
+            traces[tnum] = {'TINDEX': tnum}
+            for keyword in _trace_keywords:
+                traces[tnum][keyword] = tracedef.get(keyword)
+        plotdict[num]['traces'] = traces
+
+        if tbtracedefs:
             tbtraces = {}
-            for tbtracedef in tb[1:]:
-                tbnum = re.match('\s+(\d+)[.\n]*', tbtracedef)
-                tbnum = int(tbnum.group(1))
-                tbtraces[tbnum] = {}
-                tbtraces[tbnum]['TBINDEX'] = tbnum
-                tbtraces[tbnum]['TMSID'] = finddecstring('TMSID', tbtracedef)
-                tbtraces[tbnum]['TNAME'] = finddecstring('TNAME', tbtracedef)
-                tbtraces[tbnum]['TCOLOR'] = finddecstring('TCOLOR', tbtracedef)
-            plots[num]['tbtraces'] = tbtraces
-
-    decplots['plots'] = plots
+            for tbnum, tbtracedef in tbtracedefs:
+                tbtraces[tbnum] = {'TBINDEX': tbnum}
+                for keyword in _bilevel_keywords:
+                    tbtraces[tbnum][keyword] = tbtracedef.get(keyword)
+            plotdict[num]['tbtraces'] = tbtraces
+
+    decplots['plots'] = plotdict
 
     return decplots
+
+
+def _parse_decplot_or_none(decfile):
+    try:
+        return decfile, parse_decplot(decfile)
+    except Exception:
+        # Text displays and equation files are not plot definitions
+        return decfile, None
+
+
+@_profiled('parse_decplot_dir')
+def parse_decplot_dir(directory='/home/greta/AXAFSHARE/dec', pattern='*.dec', processes=None):
+    """Parse all GRETA dec plot files in a directory using a pool of processes.
+
+    :param directory: Directory containing GRETA dec files
+    :param pattern: Glob pattern used to select files within the directory
+    :param processes: Number of worker processes, defaults to the number of CPUs, use 1 to
+                      parse the files serially in this process
+
+    :returns: dictionary of parse_decplot output keyed by file name
+
+    Files that can not be parsed as plot definitions (e.g. text displays such as FMAIN.dec)
+    are omitted from the output.
+    """
+
+    decfiles = sorted(glob.glob(os.path.join(directory, pattern)))
+
+    with _stage('parse'):
+        if processes == 1 or len(decfiles) < 2:
+            results = [_parse_decplot_or_none(decfile) for decfile in decfiles]
+        else:
+            pool = multiprocessing.Pool(processes)
+            try:
+                results = pool.map(_parse_decplot_or_none, decfiles)
+            finally:
+                pool.close()
+                pool.join()
+
+    parsed = dict((decfile, decplots) for decfile, decplots in results if decplots is not None)
+
+    _count('files', len(decfiles))
+    _count('skipped_files', len(decfiles) - len(parsed))
+
+    return parsed
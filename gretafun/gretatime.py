@@ -0,0 +1,139 @@
+""" Bulk conversion of GRETA format times.
+
+GRETA writes times in the format YYYYDDD.hhmmsssss (e.g. 2014205.120000000). Converting each
+time with Chandra.Time.DateTime(time, 'greta') is slow for files with many lines, so these
+functions convert a whole column of GRETA times at once by rearranging the characters of a
+fixed width byte array.
+
+"""
+
+import numbers
+
+import numpy as np
+
+__all__ = ['greta_to_date', 'greta_to_secs', 'convert_greta_times', 'as_secs']
+
+# Byte offsets of each date field within a zero padded GRETA time, YYYYDDD.hhmmssSSS
+_greta_width = 17
+_date_layout = ((0, 4), (4, 7), (8, 10), (10, 12), (12, 14), (14, 17))
+_date_separators = b'::::.'
+_date_width = 21
+_digit_columns = [n for n in range(_greta_width) if n != 7]
+
+
+def _greta_bytes(times):
+    """ Return a zero padded (N, 17) uint8 array of GRETA times, and a mask of rows that can
+    not be converted by rearranging characters.
+    """
+
+    times = np.char.strip(np.atleast_1d(np.asarray(times)).astype(bytes))
+    lengths = np.char.str_len(times)
+    padded = np.char.ljust(times, _greta_width, b'0')
+    chars = padded.view(np.uint8).reshape(len(padded), padded.dtype.itemsize)
+
+    # Times with more than millisecond resolution must be rounded, and malformed times must
+    # raise the same errors as Chandra.Time, so these are passed on to DateTime
+    chars = chars[:, :_greta_width]
+    numeric = chars[:, _digit_columns]
+    fallback = ((lengths > _greta_width) | (lengths < 8) | (chars[:, 7] != ord('.')) |
+                np.any((numeric < ord('0')) | (numeric > ord('9')), axis=1))
+
+    return times, chars, fallback
+
+
+def as_secs(t):
+    """ Convert a time or sequence of times to Chandra.Time seconds.
+
+    :param t: Time in seconds (any number, or sequence or array of numbers), time in any
+              format accepted by Chandra.Time.DateTime (e.g. '2014:205:12:00:00', or a list
+              of such times), or None for the current time
+
+    :returns: Float for a single time, or NumPy float64 array for a sequence of times
+
+    Times that are already numbers are converted without importing Chandra.Time.
+
+    """
+
+    if isinstance(t, (numbers.Real, np.number)):
+        return float(t)
+    if t is not None:
+        values = np.asarray(t)
+        if values.dtype.kind in 'iuf':
+            return values.astype(np.float64)
+
+    from Chandra.Time import DateTime
+    if t is None:
+        return DateTime().secs
+    return DateTime(t).secs
+
+
+def greta_to_date(times):
+    """ Convert GRETA format times to Chandra.Time date format strings.
+
+    :param times: Sequence or array of GRETA format times (YYYYDDD.hhmmsssss)
+
+    :returns: NumPy string array of dates in YYYY:DDD:hh:mm:ss.sss format
+
+    The output is identical to Chandra.Time.DateTime(time, 'greta').date for each time.
+
+    """
+
+    if np.size(times) == 0:
+        return np.zeros(0, dtype=str)
+
+    times, chars, fallback = _greta_bytes(times)
+
+    out = np.empty((len(chars), _date_width), dtype=np.uint8)
+    pos = 0
+    for n, (start, stop) in enumerate(_date_layout):
+        out[:, pos:pos + stop - start] = chars[:, start:stop]
+        pos += stop - start
+        if n < len(_date_separators):
+            out[:, pos] = ord(_date_separators[n:n + 1])
+            pos += 1
+
+    dates = out.view('S{}'.format(_date_width)).ravel().astype(str)
+
+    if np.any(fallback):
+        from Chandra.Time import DateTime
+        slow = times[fallback].astype(str)
+        dates[fallback] = [DateTime(t, 'greta').date for t in slow]
+
+    return dates
+
+
+def greta_to_secs(times):
+    """ Convert GRETA format times to Chandra.Time seconds.
+
+    :param times: Sequence or array of GRETA format times (YYYYDDD.hhmmsssss)
+
+    :returns: NumPy float64 array of seconds, as returned by Chandra.Time.DateTime().secs
+
+    """
+
+    return convert_greta_times(times)[0]
+
+
+def convert_greta_times(times):
+    """ Convert GRETA format times to both Chandra.Time seconds and date strings.
+
+    :param times: Sequence or array of GRETA format times (YYYYDDD.hhmmsssss)
+
+    :returns: Tuple of (secs, dates) NumPy arrays, see greta_to_secs and greta_to_date
+
+    DateTime is called once, with the array of distinct dates, so the seconds are identical to
+    DateTime(time, 'greta').secs. Limit files record many lines at each time, so there are
+    usually far fewer distinct dates than times.
+
+    """
+
+    dates = greta_to_date(times)
+    if len(dates) == 0:
+        return np.zeros(0, dtype=np.float64), dates
+
+    from Chandra.Time import DateTime
+
+    unique, inverse = np.unique(dates, return_inverse=True)
+    secs = np.atleast_1d(np.asarray(DateTime(unique).secs, dtype=np.float64))
+
+    return secs[inverse.ravel()], dates
@@ -0,0 +1,251 @@
+""" Evaluate telemetry against a GRETA limit monitoring specification.
+
+The functions in this module apply the limits and expected states returned by
+gretaparse.read_glimmon directly to telemetry arrays, rather than relying on the limit file
+written by GRETA itself. All samples for a given mnemonic are evaluated at once using NumPy.
+
+Telemetry may be supplied as any mapping from mnemonic name to an object with "times" and
+"vals" attributes (such as a Ska.engarchive.fetch_eng.Msid or MSIDset), or to a (times, vals)
+tuple of arrays.
+
+"""
+
+import numpy as np
+
+__all__ = ['check_limits', 'check_limits_archive', 'limit_status_names']
+
+# Violation types, indexed by the status codes used internally. The names follow the message
+# format used in GRETA limit files.
+limit_status_names = ('NOMINAL', 'CAUTION-LOW', 'CAUTION-HIGH', 'WARNING-LOW', 'WARNING-HIGH',
+                      'OUT-OF-STATE')
+
+
+def _find_telemetry(telemetry, name):
+    """ Return (times, vals) arrays for a mnemonic, or None if it is not available.
+    """
+    for key in (name, name.upper(), name.lower()):
+        if key in telemetry:
+            data = telemetry[key]
+            if isinstance(data, tuple):
+                times, vals = data
+            else:
+                times, vals = data.times, data.vals
+            return np.asarray(times, dtype=np.float64), np.asarray(vals)
+    return None
+
+
+def _runs(code):
+    """ Return start and stop indices of runs of equal values in an integer array.
+    """
+    change = np.flatnonzero(code[1:] != code[:-1]) + 1
+    starts = np.concatenate(([0], change))
+    stops = np.concatenate((change, [len(code)]))
+    return starts, stops
+
+
+def _apply_tolerance(code, tolerance):
+    """ Clear violations that do not persist for at least "tolerance" consecutive samples.
+    """
+    if tolerance <= 1 or len(code) == 0:
+        return code
+
+    violation = (code != 0).astype(np.int8)
+    starts, stops = _runs(violation)
+    short = (violation[starts] == 1) & ((stops - starts) < tolerance)
+    if np.any(short):
+        keep = np.repeat(~short, stops - starts)
+        code = np.where(keep, code, 0)
+    return code
+
+
+def _state_strings(vals):
+    """ Return state values as stripped strings, for values read as padded or byte strings.
+    """
+    return np.char.strip(np.asarray(vals).astype(str))
+
+
+def _active_sets(entry, times, telemetry):
+    """ Return the index into entry['setkeys'] of the limit set active at each sample.
+
+    When a switch mnemonic (MLIMSW) is defined and available, the limit set whose SWITCHSTATE
+    matches the most recent switch mnemonic value is used, otherwise the default set is used.
+    """
+    setkeys = entry['setkeys']
+    default = setkeys.index(entry['default']) if entry.get('default') in setkeys else 0
+    active = np.full(len(times), default, dtype=np.int32)
+
+    switch = _find_telemetry(telemetry, entry['mlimsw']) if 'mlimsw' in entry else None
+    if switch is None or len(switch[0]) == 0:
+        return active
+
+    swtimes, swvals = switch
+    ind = np.searchsorted(swtimes, times, side='right') - 1
+    state = _state_strings(swvals)[np.clip(ind, 0, len(swvals) - 1)]
+
+    for n, setnum in enumerate(setkeys):
+        switchstate = entry[setnum].get('switchstate')
+        if switchstate is not None and n != default:
+            active[state == str(switchstate).strip()] = n
+
+    return active
+
+
+def _limit_codes(entry, vals, active):
+    """ Return status codes for a mnemonic with PPENG limits.
+    """
+    sets = [entry[setnum] for setnum in entry['setkeys']]
+    limits = dict((name, np.array([s.get(name, np.nan) for s in sets])[active])
+                  for name in ('warning_low', 'caution_low', 'caution_high', 'warning_high'))
+
+    vals = vals.astype(np.float64)
+    code = np.zeros(len(vals), dtype=np.int8)
+    with np.errstate(invalid='ignore'):
+        code[vals < limits['caution_low']] = 1
+        code[vals > limits['caution_high']] = 2
+        code[vals < limits['warning_low']] = 3
+        code[vals > limits['warning_high']] = 4
+
+    return code, limits
+
+
+def _state_codes(entry, vals, active):
+    """ Return status codes for a mnemonic with expected states (EXPST).
+    """
+    expst = [entry[setnum].get('expst') for setnum in entry['setkeys']]
+    defined = np.array([e is not None for e in expst])[active]
+    expected = np.array([e if e is not None else '' for e in expst])[active]
+
+    vals = _state_strings(vals)
+    code = np.where(defined & (vals != expected), 5, 0).astype(np.int8)
+
+    return code, expected
+
+
+def check_limits(glimmon, telemetry, msids=None, tolerance=None):
+    """ Evaluate telemetry against the limits and expected states in a G_LIMMON specification.
+
+    :param glimmon: Dictionary returned by gretaparse.read_glimmon
+    :param telemetry: Mapping of mnemonic name to telemetry, see module documentation
+    :param msids: Optional list of mnemonics to check, defaults to all mnemonics in glimmon
+    :param tolerance: Number of consecutive samples a violation must persist before it is
+                      reported, overrides the MLMTOL and MLMDEFTOL values in glimmon
+
+    :returns: Dictionary keyed by mnemonic name, each value is a list of violation intervals
+
+    Each violation interval is a dictionary with keys 'type' (e.g. 'WARNING-HIGH' or
+    'OUT-OF-STATE'), 'tstart' and 'tstop' (times of the first and last violating samples),
+    'samples' (number of samples in the interval), and 'setnum' (the active limit set at the
+    start of the interval). Limit violations also include 'min', 'max', and 'limit', expected
+    state violations include 'state' (the first observed state) and 'expst'.
+
+    Mnemonics that are disabled (MLMENABLE 0), have no limits or expected states defined in
+    the specification, or have no telemetry available are not included in the output.
+
+    """
+
+    if msids is None:
+        msids = [name for name in glimmon if isinstance(glimmon[name], dict)]
+
+    deftol = glimmon.get('mlmdeftol', 1)
+
+    violations = {}
+    for name in msids:
+        entry = glimmon.get(name)
+        if not isinstance(entry, dict) or 'type' not in entry or not entry.get('setkeys'):
+            continue
+
+        if entry.get('mlmenable', 1) == 0:
+            continue
+
+        data = _find_telemetry(telemetry, name)
+        if data is None:
+            continue
+
+        times, vals = data
+        if len(times) == 0:
+            violations[name] = []
+            continue
+
+        active = _active_sets(entry, times, telemetry)
+
+        if entry['type'] == 'limit':
+            code, limits = _limit_codes(entry, vals, active)
+        else:
+            code, expected = _state_codes(entry, vals, active)
+
+        tol = tolerance if tolerance is not None else entry.get('mlmtol', deftol)
+        code = _apply_tolerance(code, tol)
+
+        starts, stops = _runs(code)
+        bad = code[starts] != 0
+        starts = starts[bad]
+        stops = stops[bad]
+
+        if entry['type'] == 'limit' and len(starts) > 0:
+            # Each reduceat slice runs to the start of the next violation, so nominal samples
+            # are masked out and ignored by fmin/fmax
+            masked = np.where(code != 0, vals.astype(np.float64), np.nan)
+            minvals = np.fmin.reduceat(masked, starts)
+            maxvals = np.fmax.reduceat(masked, starts)
+
+        intervals = []
+        for n, (start, stop) in enumerate(zip(starts, stops)):
+            status = limit_status_names[code[start]]
+            interval = {'type': status,
+                        'tstart': float(times[start]),
+                        'tstop': float(times[stop - 1]),
+                        'samples': int(stop - start),
+                        'setnum': entry['setkeys'][active[start]]}
+
+            if entry['type'] == 'limit':
+                limitname = status.lower().replace('-', '_')
+                interval['min'] = float(minvals[n])
+                interval['max'] = float(maxvals[n])
+                interval['limit'] = float(limits[limitname][start])
+            else:
+                interval['state'] = str(vals[start]).strip()
+                interval['expst'] = str(expected[start])
+
+            intervals.append(interval)
+
+        violations[name] = intervals
+
+    return violations
+
+
+def check_limits_archive(glimmon, start, stop, msids=None, tolerance=None):
+    """ Evaluate Ska engineering archive telemetry against a G_LIMMON specification.
+
+    :param glimmon: Dictionary returned by gretaparse.read_glimmon
+    :param start: Start time in any format accepted by the Ska engineering archive
+    :param stop: Stop time in any format accepted by the Ska engineering archive
+    :param msids: Optional list of mnemonics to check, defaults to all mnemonics in glimmon
+    :param tolerance: See check_limits
+
+    :returns: See check_limits
+
+    Mnemonics that are not available in the engineering archive are skipped.
+
+    """
+
+    import Ska.engarchive.fetch_eng as fetch_eng
+
+    if msids is None:
+        msids = [name for name in glimmon if isinstance(glimmon[name], dict)]
+
+    needed = set(msids)
+    for name in msids:
+        entry = glimmon.get(name)
+        if isinstance(entry, dict) and 'mlimsw' in entry:
+            needed.add(entry['mlimsw'])
+
+    telemetry = {}
+    for name in sorted(needed):
+        try:
+            telemetry[name] = fetch_eng.Msid(name, start, stop)
+        except ValueError:
+            # The mnemonic is not in the archive (e.g. a derived mnemonic defined only in
+            # the specification file)
+            continue
+
+    return check_limits(glimmon, telemetry, msids=msids, tolerance=tolerance)
@@ -0,0 +1,145 @@
+""" Time indexed history of limit changes recorded in G_LIMMON.dec comments.
+
+The LimitHistory class flattens the limit changes parsed from the comment section of a
+G_LIMMON.dec file into time sorted arrays, with a per-mnemonic index, so that the limit in
+effect at any time and the changes made within any time range can be found by binary search.
+
+"""
+
+import numpy as np
+
+from .gretaparse import _comment_entries
+from .gretatime import as_secs
+from .profiling import _profiled
+
+__all__ = ['LimitHistory']
+
+
+class LimitHistory(object):
+    """ Time indexed history of limit changes in a G_LIMMON.dec file.
+
+    :param entries: List of comment entries, as returned by LimitHistory.from_file
+
+    Example:
+
+        history = LimitHistory.from_file('/home/greta/AXAFSHARE/dec/G_LIMMON.dec')
+        history.limit_at('tephin', 'caution high', '2013:100')
+        history.changes_between('2012:001', '2013:001')
+
+    Mnemonic names and limit types are not case sensitive. Limit values are returned as the
+    strings recorded in the comments.
+
+    """
+
+    def __init__(self, entries):
+        rows = []
+        for order, entry in enumerate(entries):
+            for msid, changes in entry['changes'].items():
+                for changetype, change in changes.items():
+                    rows.append((entry['secs'], order, msid.lower(), changetype.strip().lower(),
+                                 change['old'], change['new'], change['description'],
+                                 entry['date'], entry['name']))
+
+        # Sort by time, changes recorded on the same date keep the order in the file
+        rows.sort(key=lambda row: (row[0], row[1]))
+
+        columns = list(zip(*rows)) if rows else [()] * 9
+        self.times = np.array(columns[0], dtype=np.float64)
+        self.msids = np.array(columns[2], dtype=str)
+        self.types = np.array(columns[3], dtype=str)
+        self.old = np.array(columns[4], dtype=str)
+        self.new = np.array(columns[5], dtype=str)
+        self.descriptions = np.array(columns[6], dtype=str)
+        self.dates = np.array(columns[7], dtype=str)
+        self.names = np.array(columns[8], dtype=str)
+
+        # Indices (in time order) of the changes to each mnemonic and limit type
+        self._index = {}
+        for n, key in enumerate(zip(columns[2], columns[3])):
+            self._index.setdefault(key, []).append(n)
+        self._msid_index = {}
+        for key in self._index:
+            self._index[key] = np.array(self._index[key])
+            self._msid_index.setdefault(key[0], []).extend(self._index[key])
+        for msid in self._msid_index:
+            self._msid_index[msid] = np.array(sorted(self._msid_index[msid]))
+
+    @classmethod
+    @_profiled('LimitHistory.from_file')
+    def from_file(cls, filename='/home/greta/AXAFSHARE/dec/G_LIMMON.dec', startline=603):
+        """ Build the limit change history from the comment section of a G_LIMMON.dec file.
+
+        :param filename: File name of GRETA limit monitoring specification file
+        :param startline: See gretaparse.parse_comments
+
+        :returns: LimitHistory instance
+
+        """
+        return cls(_comment_entries(filename, startline))
+
+    def __len__(self):
+        return len(self.times)
+
+    def keys(self):
+        """ Return a list of (msid, limit type) pairs with recorded changes.
+        """
+        return sorted(self._index.keys())
+
+    def limit_at(self, msid, limittype, t):
+        """ Return the limit of a given type for a mnemonic at a given time.
+
+        :param msid: Mnemonic name
+        :param limittype: Limit type as recorded in the comments (e.g. 'caution high')
+        :param t: Time or array of times, in seconds or any format accepted by DateTime
+
+        :returns: Limit value string (or array of strings for an array of times), or None if no
+                  changes to this limit are recorded
+
+        Before the first recorded change the original ("From") value of that change is
+        returned, afterwards the new ("To") value of the most recent change is returned.
+
+        """
+
+        ind = self._index.get((msid.lower(), limittype.strip().lower()))
+        if ind is None:
+            return None
+
+        secs = as_secs(t)
+        pos = np.searchsorted(self.times[ind], secs, side='right')
+        values = np.where(pos == 0, self.old[ind[0]], self.new[ind[np.maximum(pos, 1) - 1]])
+
+        if np.ndim(values) == 0:
+            return str(values)
+        return values
+
+    def changes_between(self, tstart, tstop, msid=None):
+        """ Return the limit changes recorded between two times (inclusive).
+
+        :param tstart: Start time, in seconds or any format accepted by DateTime
+        :param tstop: Stop time, in seconds or any format accepted by DateTime
+        :param msid: Optional mnemonic name, to only return changes to that mnemonic
+
+        :returns: List of dictionaries with 'secs', 'date', 'name', 'msid', 'type', 'old',
+                  'new', and 'description' keys, in time order
+
+        """
+
+        if msid is None:
+            start = np.searchsorted(self.times, as_secs(tstart), side='left')
+            stop = np.searchsorted(self.times, as_secs(tstop), side='right')
+            rows = range(start, stop)
+        else:
+            rows = self._msid_index.get(msid.lower(), np.zeros(0, dtype=int))
+            times = self.times[rows]
+            start = np.searchsorted(times, as_secs(tstart), side='left')
+            stop = np.searchsorted(times, as_secs(tstop), side='right')
+            rows = rows[start:stop]
+
+        return [{'secs': float(self.times[n]),
+                 'date': str(self.dates[n]),
+                 'name': str(self.names[n]),
+                 'msid': str(self.msids[n]),
+                 'type': str(self.types[n]),
+                 'old': str(self.old[n]),
+                 'new': str(self.new[n]),
+                 'description': str(self.descriptions[n])} for n in rows]
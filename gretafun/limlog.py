@@ -0,0 +1,705 @@
+""" Incremental processing of GRETA limit files.
+
+The LimitLog class accumulates the per-mnemonic limit violation statistics returned by
+gretaparse.process_limits_file, and can be updated with new limit file lines at any time. The
+LimitFileFollower class uses a LimitLog to follow a limit file that is still being written,
+consuming only the lines appended since the previous update, and can save its state to a
+checkpoint file so that a restarted process continues where the previous one left off.
+
+Partial results accumulated from different files can be combined with LimitLog.merge, which
+process_limits_files uses to summarize many limit files in parallel.
+
+In compact mode, out of state values are recorded in run-length encoded StateLog objects
+rather than lists, so memory use depends on the number of state changes rather than on the
+number of out of state lines. expand_limlog converts a compact summary to the legacy format.
+
+"""
+
+import copy
+import functools
+import glob
+import hashlib
+import multiprocessing
+import os
+import pickle
+
+from .gretatime import greta_to_date
+from .profiling import _profiled, _stage, _count, _active
+from .tdbmeta import default_metadata, TableMetadata
+
+try:
+    from sys import intern
+except ImportError:
+    # Python 2, intern is a builtin
+    pass
+
+__all__ = ['LimitLog', 'LimitFileFollower', 'StateLog', 'process_limits_files', 'expand_limlog']
+
+
+def _fmax(a, b):
+    """ Return the larger of two floats, or NaN if either is NaN (as np.max would).
+    """
+    return a if (a >= b or a != a) else b
+
+
+def _fmin(a, b):
+    """ Return the smaller of two floats, or NaN if either is NaN (as np.min would).
+    """
+    return a if (a <= b or a != a) else b
+
+
+class StateLog(object):
+    """ Run-length encoded log of out of state values.
+
+    :param values: Optional initial values
+
+    Consecutive equal values are stored once, with a count, and each distinct value is
+    interned. A StateLog behaves like the list of values it encodes: it can be iterated,
+    appended to, concatenated with "+", and compares equal to the equivalent list.
+
+    The "runs" attribute is the list of [value, count] pairs.
+
+    """
+
+    def __init__(self, values=()):
+        self.runs = []
+        self.extend(values)
+
+    def append(self, value):
+        if self.runs and self.runs[-1][0] == value:
+            self.runs[-1][1] += 1
+        else:
+            self.runs.append([intern(value) if isinstance(value, str) else value, 1])
+
+    def extend(self, values):
+        if isinstance(values, StateLog):
+            for value, count in values.runs:
+                self.append(value)
+                self.runs[-1][1] += count - 1
+        else:
+            for value in values:
+                self.append(value)
+
+    def counts(self):
+        """ Return a dictionary of the number of times each value was recorded.
+        """
+        counts = {}
+        for value, count in self.runs:
+            counts[value] = counts.get(value, 0) + count
+        return counts
+
+    def tolist(self):
+        """ Return the list of values, as recorded in the legacy limlog format.
+        """
+        return list(self)
+
+    def __iter__(self):
+        for value, count in self.runs:
+            for _ in range(count):
+                yield value
+
+    def __len__(self):
+        return sum(count for value, count in self.runs)
+
+    def __add__(self, other):
+        combined = StateLog(self)
+        combined.extend(other)
+        return combined
+
+    def __radd__(self, other):
+        combined = StateLog(other)
+        combined.extend(self)
+        return combined
+
+    def __eq__(self, other):
+        if isinstance(other, StateLog):
+            return self.runs == other.runs
+        return self.tolist() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'StateLog({!r})'.format(self.runs)
+
+
+def expand_limlog(limlog):
+    """ Convert a compact limit violation summary to the legacy format.
+
+    :param limlog: Dictionary returned by process_limits_file or LimitLog.limlog
+
+    :returns: Copy of limlog with each StateLog replaced by a list of values
+
+    """
+
+    expanded = {}
+    for msid, entry in limlog.items():
+        entry = dict(entry)
+        if isinstance(entry.get('statelog'), StateLog):
+            entry['statelog'] = entry['statelog'].tolist()
+        expanded[msid] = entry
+    return expanded
+
+
+class LimitLog(object):
+    """ Accumulate limit violation statistics from GRETA limit file lines.
+
+    :param metadata: Metadata provider used to look up mnemonic owners and descriptions (see
+                     tdbmeta), defaults to the Ska telemetry database
+    :param compact: If True, record out of state values in run-length encoded StateLog objects
+                    rather than lists
+
+    The accumulated statistics are available in the "limlog" attribute, which has the same
+    format as the dictionary returned by gretaparse.process_limits_file.
+
+    """
+
+    def __init__(self, metadata=None, compact=False):
+        self.metadata = metadata
+        self.compact = compact
+        self.limlog = {}
+        self._partial = {}
+
+    def _statelog(self, value):
+        return StateLog([value]) if self.compact else [value]
+
+    def legacy(self):
+        """ Return the accumulated statistics in the legacy format, see expand_limlog.
+        """
+        return expand_limlog(self.limlog)
+
+    @_profiled('LimitLog.update')
+    def update(self, lines):
+        """ Add limit file lines to the accumulated statistics.
+
+        :param lines: List of lines read from a GRETA limit file
+
+        :returns: Set of mnemonic names updated by these lines
+
+        """
+
+        with _stage('split'):
+            limwords = [line.split() for line in lines]
+            msids = set(words[2] for words in limwords if words)
+
+        # Look up the owner and description for all new mnemonics in one batch
+        with _stage('metadata'):
+            metadata = self.metadata if self.metadata is not None else default_metadata
+            newmsids = msids.difference(self.limlog)
+            msidinfo = metadata.lookup(newmsids)
+
+        # Convert all of the times at once
+        with _stage('time_conversion'):
+            entries = [(line, words) for line, words in zip(lines, limwords) if words]
+            if entries:
+                tstrings = greta_to_date([words[0] for line, words in entries]).tolist()
+            else:
+                tstrings = []
+
+        with _stage('accumulate'):
+            for (line, words), tstring in zip(entries, tstrings):
+                self._add(line, words, tstring, msidinfo)
+
+        if _active():
+            _count('lines', len(lines))
+            _count('blank_lines', len(lines) - len(entries))
+            _count('skipped_lines', sum(1 for line, words in entries
+                                        if len(words) == 6 or words[4] == 'none'))
+            _count('metadata_lookups', len(newmsids))
+
+        return msids
+
+    def _add(self, line, words, tstring, msidinfo):
+        """ Add a single limit file line to the accumulated statistics.
+        """
+
+        limlog = self.limlog
+        msid = words[2]
+        msg = words[3]
+        currentval = words[4]
+        opr = lim = None
+
+        # There should be 5 columns for a return to NOMINAL and 7 colums
+        # for a violation. In cases where data gets corrupted for whatever
+        # reason, the current value can be left blank. When this gets left
+        # blank, treat this as a violation but assign 'none' as the current
+        # value.
+
+        if len(words) == 7:
+            opr = words[5]
+            lim = words[6]
+
+        elif len(words) == 6:
+            currentval = 'none'
+            opr = words[4]
+            lim = words[5]
+
+        # if the current value is equal to none, then skip this
+        # line in the limits file
+        if currentval != 'none':
+
+            # Bookkeeping needed to merge partial results, see merge()
+            if msid not in self._partial:
+                self._partial[msid] = {'first': tstring, 'lead': 0, 'leadend': None,
+                                       'reset': False, 'rawlimit': None}
+            partial = self._partial[msid]
+            if msg == 'NOMINAL':
+                if 'firstviolation' not in limlog.get(msid, {}):
+                    partial['lead'] += 1
+                    partial['leadend'] = tstring
+            elif 'WARNING' in msg or 'CAUTION' not in msg:
+                partial['reset'] = True
+                partial['rawlimit'] = lim
+            elif 'WARNING' not in limlog.get(msid, {}).get('worsttype', ''):
+                partial['rawlimit'] = lim
+
+            if msid in limlog:
+
+                if 'firstviolation' in limlog[msid]:
+
+                    # if it is nominal, then increase the toggle count
+                    if words[3] == 'NOMINAL':
+                        limlog[msid]['num'] = limlog[msid]['num'] + 1
+                        limlog[msid].update({'endtime':tstring})
+
+                    # if it is not nominal, then all you need to worry
+                    # about is determining what the worst violation type
+                    # is. This assumes that an msid won't cross a high and
+                    # low limit in the same period over which this script
+                    # is run.
+                    else:
+
+                        # The following if-else statement will not return
+                        # return correct results if both a high and a low
+                        # limit violation occurs in the same file. This
+                        # would only be likely to happen if the telemetry
+                        # stream were corrupt.
+                        if 'WARNING' in msg:
+                            maxval = _fmax(float(currentval), limlog[msid]['max'])
+                            minval = _fmin(float(currentval), limlog[msid]['min'])
+                            limlog[msid]['worsttype'] = msg
+                            limlog[msid]['max'] = maxval
+                            limlog[msid]['min'] = minval
+                            limlog[msid]['limit'] = lim
+
+                        elif 'CAUTION' in msg:
+                            maxval = _fmax(float(currentval), limlog[msid]['max'])
+                            minval = _fmin(float(currentval), limlog[msid]['min'])
+
+                            if 'worsttype' in limlog[msid]:
+
+                                if 'WARNING' not in limlog[msid]['worsttype']:
+                                    limlog[msid]['worsttype'] = msg
+                                    limlog[msid]['limit'] = lim
+                            else:
+                                limlog[msid]['worsttype'] = msg
+                                limlog[msid]['limit'] = lim
+
+                            limlog[msid]['max'] = maxval
+                            limlog[msid]['min'] = minval
+
+                        else:
+                            # Then this must be an out of state violation
+                            limlog[msid]['worsttype'] = msg
+                            limlog[msid]['statelog'].append(currentval)
+
+                            # use same name as limits for simplicity
+                            limlog[msid]['limit'] = lim
+
+                # In this case, an msid has already been recorded, but
+                # without a first violation, which means it must have been
+                # a return to nominal (since this msid already has an
+                # entry)
+                else:
+
+                    if msg == 'OUT-OF-STATE':
+                        limlog[msid].update({'statelog':self._statelog(currentval)})
+                        limlog[msid].update({'initialvalue':currentval})
+                        limlog[msid].update({'limit':lim})
+                        limlog[msid].update({'firstviolation':tstring})
+                        limlog[msid].update({'worsttype':msg})
+
+                    elif msg == 'NOMINAL':
+                        # do nothing, this is a repeat return to nominal
+                        pass
+
+                    else:
+                        limlog[msid].update({'max':float(currentval)})
+                        limlog[msid].update({'min':float(currentval)})
+                        limlog[msid].update({'initialvalue': float(currentval)})
+                        limlog[msid].update({'limit':float(lim)})
+                        limlog[msid].update({'firstviolation':tstring})
+                        limlog[msid].update({'worsttype':msg})
+
+            else:
+                limlog.update({msid:{}})
+                limlog[msid].update({'owner':msidinfo[msid]['owner']})
+                limlog[msid].update({'description':msidinfo[msid]['description']})
+
+                if words[3] != 'NOMINAL': # if NOT nominal
+                    limlog[msid].update({'firstviolation':tstring})
+                    limlog[msid].update({'worsttype':msg})
+                    limlog[msid].update({'num':0})
+
+                    if msg == 'OUT-OF-STATE':
+                        limlog[msid].update({'statelog':self._statelog(currentval)})
+                        limlog[msid].update({'initialvalue':currentval})
+                        limlog[msid].update({'limit':lim})
+                    else:
+                        limlog[msid].update({'max':float(currentval)})
+                        limlog[msid].update({'min':float(currentval)})
+                        limlog[msid].update({'initialvalue': float(currentval)})
+                        limlog[msid].update({'limit':float(lim)})
+
+                else:
+                    limlog[msid].update({'num':0})
+                    limlog[msid].update({'comment':'return to nominal ' 
+                                         + 'is observed before violation'})
+
+        else:
+            print('Skipped this line in the limits file due to missing value:\n{}\n'
+                  .format(line))
+
+    def merge(self, other):
+        """ Combine the statistics accumulated from two sets of limit file lines.
+
+        :param other: LimitLog accumulated from a different set of lines (e.g. another file)
+
+        :returns: New LimitLog, neither input is modified
+
+        Partial results should come from lines that do not overlap in time, such as separate
+        daily limit files. The result is the same as if the lines for each mnemonic had been
+        processed in time order by a single LimitLog, regardless of which of the two is passed
+        first: returns to nominal are counted, min and max are combined, the worst violation
+        type is kept with WARNING taking precedence over CAUTION, the earliest first violation
+        and latest end time are kept, and out of state logs are concatenated in time order.
+
+        When combining more than two partial results, each merge must combine results that are
+        adjacent in time (e.g. merge them in time order, as process_limits_files does), since a
+        merged result cannot take in lines from a gap between the two results it combined.
+
+        """
+
+        merged = LimitLog(metadata=self.metadata, compact=self.compact)
+        merged.limlog = copy.deepcopy(self.limlog)
+        merged._partial = copy.deepcopy(self._partial)
+        merged._fold(other)
+
+        return merged
+
+    def _fold(self, other):
+        """ Combine the statistics from another LimitLog into this one in place.
+
+        :param other: LimitLog accumulated from a different set of lines, not modified
+
+        Only the entries copied from other are new objects, so folding many partial results
+        into one accumulator takes time proportional to their total size.
+
+        """
+
+        for msid, entry in other.limlog.items():
+            entry = copy.deepcopy(entry)
+            partial = dict(other._partial[msid])
+
+            if msid not in self.limlog:
+                self.limlog[msid] = entry
+                self._partial[msid] = partial
+                continue
+
+            # Order the two partial results in time
+            pairs = [(self.limlog[msid], self._partial[msid]), (entry, partial)]
+            pairs.sort(key=lambda pair: pair[1]['first'])
+            (early, earlypart), (late, latepart) = pairs
+
+            self.limlog[msid], self._partial[msid] = _merge_entries(early, earlypart,
+                                                                    late, latepart)
+
+    def __getstate__(self):
+        # Metadata providers are not saved with the accumulated statistics
+        return {'limlog': self.limlog, 'partial': self._partial, 'compact': self.compact}
+
+    def __setstate__(self, state):
+        self.metadata = None
+        self.compact = state.get('compact', False)
+        self.limlog = state['limlog']
+        self._partial = state.get('partial', {})
+
+
+def _merge_entries(early, earlypart, late, latepart):
+    """ Combine the statistics for one mnemonic from two time ordered partial results.
+
+    The out of state log of the earlier result is extended in place.
+
+    """
+
+    if 'firstviolation' not in early:
+        # The earlier lines were only returns to nominal, which are ignored until the first
+        # violation
+        entry = dict(late)
+        entry['comment'] = early['comment']
+        partial = dict(latepart)
+        partial['first'] = earlypart['first']
+        partial['lead'] = earlypart['lead'] + latepart['lead']
+        partial['leadend'] = latepart['leadend'] or earlypart['leadend']
+        return entry, partial
+
+    entry = dict(early)
+    partial = dict(earlypart)
+
+    # Returns to nominal in the later lines all follow a violation
+    entry['num'] = early['num'] + latepart['lead'] + late['num']
+    if 'endtime' in late:
+        entry['endtime'] = late['endtime']
+    elif latepart['leadend'] is not None:
+        entry['endtime'] = latepart['leadend']
+
+    if 'firstviolation' not in late:
+        return entry, partial
+
+    if 'max' in late:
+        entry['max'] = _fmax(entry.get('max', late['max']), late['max'])
+        entry['min'] = _fmin(entry.get('min', late['min']), late['min'])
+
+    if 'statelog' in late:
+        if 'statelog' in entry:
+            entry['statelog'].extend(late['statelog'])
+        else:
+            entry['statelog'] = late['statelog']
+
+    # CAUTION violations do not replace an earlier WARNING, any other violation type does
+    if latepart['reset'] or 'WARNING' not in early['worsttype']:
+        entry['worsttype'] = late['worsttype']
+        entry['limit'] = latepart['rawlimit']
+        partial['rawlimit'] = latepart['rawlimit']
+    partial['reset'] = earlypart['reset'] or latepart['reset']
+
+    return entry, partial
+
+
+def _line_batches(fid, batchsize=100000):
+    """ Yield lists of at most batchsize lines read from an open file.
+    """
+    batch = []
+    for line in fid:
+        batch.append(line)
+        if len(batch) >= batchsize:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _summarize_file(filename, compact=False):
+    """ Accumulate statistics for one limit file without looking up mnemonic metadata.
+    """
+
+    limits = LimitLog(metadata=TableMetadata({}), compact=compact)
+    with open(filename, 'r') as fid:
+        for limlines in _line_batches(fid):
+            limits.update(limlines)
+    limits.metadata = None
+
+    return limits
+
+
+def process_limits_files(filenames, processes=None, metadata=None, compact=False):
+    """ Process many limit files in parallel and combine the results.
+
+    :param filenames: List of G_LIMMON output file names, or a glob pattern
+    :param processes: Number of worker processes, defaults to the number of CPUs, use 1 to
+                      process the files serially in this process
+    :param metadata: Metadata provider used to look up mnemonic owners and descriptions (see
+                     tdbmeta), defaults to the Ska telemetry database
+    :param compact: If True, out of state values are recorded in StateLog objects (see
+                    process_limits_file)
+
+    :returns: Dictionary of limit violations and relevant statistics, in the same format as
+              process_limits_file
+
+    Each file is summarized independently, and the partial results are combined as in
+    LimitLog.merge. Mnemonic owners and descriptions are looked up once, after all files have
+    been processed.
+
+    """
+
+    if isinstance(filenames, str):
+        filenames = sorted(glob.glob(filenames))
+
+    summarize = functools.partial(_summarize_file, compact=compact)
+    if processes == 1 or len(filenames) < 2:
+        partials = [summarize(filename) for filename in filenames]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            partials = pool.map(summarize, filenames)
+        finally:
+            pool.close()
+            pool.join()
+
+    # Merge in time order so that each merge combines adjacent partial results, folding each
+    # into a single accumulator rather than copying the combined result for every file
+    partials.sort(key=lambda limits: min([p['first'] for p in limits._partial.values()] or ['']))
+    limits = LimitLog(compact=compact)
+    for partial in partials:
+        limits._fold(partial)
+
+    if metadata is None:
+        metadata = default_metadata
+    msidinfo = metadata.lookup(limits.limlog)
+    for msid, entry in limits.limlog.items():
+        entry['owner'] = msidinfo[msid]['owner']
+        entry['description'] = msidinfo[msid]['description']
+
+    return limits.limlog
+
+
+class LimitFileFollower(object):
+    """ Follow a GRETA limit file that is still being written.
+
+    :param filename: File name of G_LIMMON output file
+    :param metadata: Metadata provider used to look up mnemonic owners and descriptions (see
+                     tdbmeta), defaults to the Ska telemetry database
+    :param checkpoint: Optional checkpoint file name, if this file exists the saved state is
+                       restored, and save() writes to this file by default
+    :param compact: If True, out of state values are recorded in StateLog objects (see
+                    LimitLog)
+
+    Each call to update() reads only the bytes appended to the file since the previous call, and
+    updates the accumulated statistics in place. A partially written last line is left for the
+    next update. The file is identified by its device and inode numbers and a hash of its first
+    line. If the file is truncated, or rotated or replaced by a different file (of any size),
+    the statistics are reset and the new file is processed from the beginning.
+
+    Example:
+
+        follower = LimitFileFollower('limfile.txt', checkpoint='limfile.chk')
+        limlog = follower.update()
+        follower.save()
+
+    """
+
+    # Number of bytes read from the limit file at a time
+    blocksize = 1 << 23
+
+    # Maximum number of bytes of the first line used to identify the limit file
+    identitysize = 4096
+
+    def __init__(self, filename='limfile.txt', metadata=None, checkpoint=None, compact=False):
+        self.filename = filename
+        self.checkpoint = checkpoint
+        self.offset = 0
+        self.identity = None
+        self.limits = LimitLog(metadata=metadata, compact=compact)
+
+        if checkpoint is not None and os.path.exists(checkpoint):
+            self.restore(checkpoint)
+
+    @property
+    def limlog(self):
+        """ Dictionary of limit violations and relevant statistics (see process_limits_file).
+        """
+        return self.limits.limlog
+
+    def update(self):
+        """ Process lines appended to the limit file since the previous update.
+
+        :returns: Dictionary of limit violations and relevant statistics, updated in place
+
+        """
+
+        if not os.path.exists(self.filename):
+            return self.limlog
+
+        if self.offset and (os.path.getsize(self.filename) < self.offset or
+                            self._identity() != self.identity):
+            self.reset()
+
+        # Read in blocks so that catching up with a large file does not hold it all in memory,
+        # and only consume complete lines
+        with open(self.filename, 'rb') as fid:
+            fid.seek(self.offset)
+            data = b''
+            block = fid.read(self.blocksize)
+            while block:
+                data += block
+                end = data.rfind(b'\n') + 1
+                if end > 0:
+                    lines = data[:end].decode('ascii', 'replace').splitlines(True)
+                    self.limits.update(lines)
+                    self.offset += end
+                    data = data[end:]
+                block = fid.read(self.blocksize)
+
+        # Once a complete line has been read, the first line no longer changes
+        if self.offset and self.identity is None:
+            self.identity = self._identity()
+
+        return self.limlog
+
+    def _identity(self):
+        """ Return a tuple identifying the limit file, to detect rotation or replacement.
+        """
+        stat = os.stat(self.filename)
+        with open(self.filename, 'rb') as fid:
+            first = fid.readline(self.identitysize)
+        return (stat.st_dev, stat.st_ino, hashlib.sha1(first).hexdigest())
+
+    def reset(self):
+        """ Discard the accumulated statistics and start again at the beginning of the file.
+        """
+        self.offset = 0
+        self.identity = None
+        self.limits = LimitLog(metadata=self.limits.metadata, compact=self.limits.compact)
+
+    def save(self, checkpoint=None):
+        """ Save the current state to a checkpoint file.
+
+        :param checkpoint: Checkpoint file name, defaults to the checkpoint given at creation
+
+        """
+
+        checkpoint = checkpoint if checkpoint is not None else self.checkpoint
+        state = {'filename': os.path.abspath(self.filename),
+                 'offset': self.offset,
+                 'identity': self.identity,
+                 'limits': self.limits}
+
+        # Write to a temporary file first so an interrupted save never leaves a corrupt
+        # checkpoint behind
+        tmpname = checkpoint + '.tmp'
+        with open(tmpname, 'wb') as fid:
+            pickle.dump(state, fid, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmpname, checkpoint)
+
+    def restore(self, checkpoint=None):
+        """ Restore the state saved to a checkpoint file.
+
+        :param checkpoint: Checkpoint file name, defaults to the checkpoint given at creation
+
+        If the limit file has been rotated or replaced since the checkpoint was saved, the
+        saved state is discarded and the new file is processed from the beginning.
+
+        """
+
+        checkpoint = checkpoint if checkpoint is not None else self.checkpoint
+        with open(checkpoint, 'rb') as fid:
+            state = pickle.load(fid)
+
+        if state['filename'] != os.path.abspath(self.filename):
+            raise ValueError('Checkpoint {} was saved for {}, not {}'.format(
+                checkpoint, state['filename'], self.filename))
+
+        identity = state.get('identity')
+        if state['offset'] and (not os.path.exists(self.filename) or
+                                os.path.getsize(self.filename) < state['offset'] or
+                                identity is None or self._identity() != tuple(identity)):
+            self.reset()
+            return
+
+        metadata = self.limits.metadata
+        self.offset = state['offset']
+        self.identity = tuple(identity) if identity is not None else None
+        self.limits = state['limits']
+        self.limits.metadata = metadata
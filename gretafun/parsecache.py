@@ -0,0 +1,231 @@
+""" Persistent cache for parsed GRETA specification files.
+
+GRETA specification files such as G_LIMMON.dec change only a few times a year, while the
+functions that parse them are called by many short lived processes. The ParseCache class
+keeps parsed results in an in-process least-recently-used store and in an on-disk pickle
+store, so that only the first process to see a given revision of a file pays the parse cost.
+
+Cached entries are keyed by the parsing function, its arguments, and the absolute path of the
+file, and are validated against the file modification time, size, and content hash. Entries
+are invalidated automatically when the file changes.
+
+"""
+
+import collections
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+
+from .gretaparse import read_glimmon, parse_comments, parse_decplot
+from .profiling import _count as _profile_count
+from .version import __version__
+
+__all__ = ['ParseCache', 'default_cache', 'cached_read_glimmon', 'cached_parse_comments',
+           'cached_parse_decplot']
+
+
+def _default_cachedir():
+    cachedir = os.environ.get('GRETAFUN_CACHE_DIR')
+    if cachedir is None:
+        cachedir = os.path.join(os.path.expanduser('~'), '.cache', 'gretafun')
+    return cachedir
+
+
+def _file_digest(filename, blocksize=1 << 20):
+    """ Return the SHA1 hex digest of the contents of a file.
+    """
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as fid:
+        block = fid.read(blocksize)
+        while block:
+            sha.update(block)
+            block = fid.read(blocksize)
+    return sha.hexdigest()
+
+
+class ParseCache(object):
+    """ In-process LRU and on-disk cache for GRETA file parsers.
+
+    :param cachedir: Directory used for the on-disk store, defaults to the GRETAFUN_CACHE_DIR
+                     environment variable or ~/.cache/gretafun
+    :param maxsize: Maximum number of parsed results held in memory
+    :param persistent: If False, only the in-process store is used
+
+    Cached results are shared between callers and should be treated as read-only.
+
+    Example:
+
+        cache = ParseCache()
+        glimmon = cache.read_glimmon('/home/greta/AXAFSHARE/dec/G_LIMMON.dec')
+        print(cache.stats())
+
+    """
+
+    def __init__(self, cachedir=None, maxsize=32, persistent=True):
+        self.cachedir = cachedir if cachedir is not None else _default_cachedir()
+        self.maxsize = maxsize
+        self.persistent = persistent
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._counts = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def read_glimmon(self, filename='/home/greta/AXAFSHARE/dec/G_LIMMON.dec', columnar=False):
+        """ Cached version of gretaparse.read_glimmon.
+        """
+        return self.get(read_glimmon, filename, columnar=columnar)
+
+    def parse_comments(self, filename='/home/greta/AXAFSHARE/dec/G_LIMMON.dec', startline=603):
+        """ Cached version of gretaparse.parse_comments.
+        """
+        return self.get(parse_comments, filename, startline=startline)
+
+    def parse_decplot(self, decfile):
+        """ Cached version of gretaparse.parse_decplot.
+        """
+        return self.get(parse_decplot, decfile)
+
+    def get(self, func, filename, **kwargs):
+        """ Return func(filename, **kwargs), using a cached result when it is still valid.
+
+        :param func: Parsing function that takes a file name as its first argument
+        :param filename: File name to be parsed
+        :param kwargs: Additional keyword arguments passed to func
+
+        :returns: Output of func
+
+        """
+
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        signature = (stat.st_mtime, stat.st_size)
+        key = (func.__name__, path, tuple(sorted(kwargs.items())))
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry['signature'] == signature:
+                self._memory[key] = self._memory.pop(key)
+                self._counts['hits'] += 1
+            else:
+                entry = None
+
+        if entry is not None:
+            _profile_count('cache_hits', function=func.__name__)
+            return entry['result']
+
+        digest = None
+        if self.persistent:
+            stored = self._load(key)
+            if stored is not None:
+                if stored['signature'] != signature:
+                    # The file was touched; only trust the stored result if the contents
+                    # are unchanged
+                    digest = _file_digest(path)
+                    if stored['digest'] != digest:
+                        stored = None
+                        self._count('invalidations', func)
+                    else:
+                        stored['signature'] = signature
+                        self._store(key, stored)
+
+            if stored is not None:
+                self._remember(key, stored)
+                self._count('disk_hits', func)
+                return stored['result']
+
+        self._count('misses', func)
+        if digest is None and self.persistent:
+            digest = _file_digest(path)
+        result = func(filename, **kwargs)
+        entry = {'signature': signature, 'digest': digest, 'result': result}
+        self._remember(key, entry)
+        if self.persistent:
+            self._store(key, entry)
+
+        return result
+
+    def stats(self):
+        """ Return a dictionary of cache hit, miss, and invalidation counts.
+        """
+        with self._lock:
+            counts = dict(self._counts)
+            counts['size'] = len(self._memory)
+        return counts
+
+    def clear(self, disk=False):
+        """ Empty the in-process store, and optionally the on-disk store.
+        """
+        with self._lock:
+            self._memory.clear()
+
+        if disk and os.path.isdir(self.cachedir):
+            for name in os.listdir(self.cachedir):
+                if name.endswith('.pkl'):
+                    try:
+                        os.remove(os.path.join(self.cachedir, name))
+                    except OSError:
+                        pass
+
+    def _count(self, name, func):
+        with self._lock:
+            self._counts[name] += 1
+        _profile_count('cache_' + name, function=func.__name__)
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._memory.pop(key, None)
+            self._memory[key] = entry
+            while len(self._memory) > self.maxsize:
+                self._memory.popitem(last=False)
+
+    def _diskname(self, key):
+        token = repr((__version__,) + key).encode('utf-8')
+        return os.path.join(self.cachedir, hashlib.sha1(token).hexdigest() + '.pkl')
+
+    def _load(self, key):
+        try:
+            with open(self._diskname(key), 'rb') as fid:
+                return pickle.load(fid)
+        except Exception:
+            # Missing, truncated or otherwise unreadable entries are treated as a miss
+            return None
+
+    def _store(self, key, entry):
+        try:
+            if not os.path.isdir(self.cachedir):
+                os.makedirs(self.cachedir)
+            fd, tmpname = tempfile.mkstemp(dir=self.cachedir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as fid:
+                pickle.dump(entry, fid, pickle.HIGHEST_PROTOCOL)
+            # Rename is atomic, so concurrent readers never see a partially written entry
+            os.rename(tmpname, self._diskname(key))
+        except (IOError, OSError):
+            pass
+
+
+default_cache = ParseCache()
+
+
+def cached_read_glimmon(filename='/home/greta/AXAFSHARE/dec/G_LIMMON.dec', columnar=False):
+    """ Read G_LIMMON.dec format file, using the default parse cache.
+
+    See gretaparse.read_glimmon and ParseCache.
+    """
+    return default_cache.read_glimmon(filename, columnar=columnar)
+
+
+def cached_parse_comments(filename='/home/greta/AXAFSHARE/dec/G_LIMMON.dec', startline=603):
+    """ Parse the comment section of a G_LIMMON.dec file, using the default parse cache.
+
+    See gretaparse.parse_comments and ParseCache.
+    """
+    return default_cache.parse_comments(filename, startline=startline)
+
+
+def cached_parse_decplot(decfile):
+    """ Parse a GRETA dec plot file, using the default parse cache.
+
+    See gretaparse.parse_decplot and ParseCache.
+    """
+    return default_cache.parse_decplot(decfile)
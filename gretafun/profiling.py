@@ -0,0 +1,267 @@
+""" Opt-in profiling of the GRETA file parsers.
+
+The parsing entry points (read_glimmon, parse_comments, process_limits_file, parse_decplot,
+parse_decplot_dir, LimitLog.update, and LimitHistory.from_file) record the time spent in each
+of their stages, and counts such as the number of lines read, lines skipped, metadata lookups,
+and parse cache hits, whenever a Profiler is active:
+
+    with Profiler() as prof:
+        limlog = process_limits_file('limfile.txt')
+
+    prof.as_dict()['process_limits_file']['stages']['metadata']['seconds']
+    print(prof.to_prometheus())
+
+Stages and counts are attributed to the innermost profiled function running on each thread, so
+process_limits_file records the time taken to read the file, and the LimitLog.update call it
+makes records the split, metadata lookup, time conversion, and accumulation stages. Parse cache
+events are attributed to the cached parsing function. Work done in worker processes (e.g. by
+parse_decplot_dir) is not recorded.
+
+When no Profiler is active, each profiled call costs one extra function call and a check of an
+empty list; nothing is recorded per line.
+
+"""
+
+import collections
+import functools
+import threading
+import time
+
+__all__ = ['Profiler']
+
+# Active profilers, every event is recorded by each of them
+_profilers = []
+
+# Stack of profiled function names for each thread
+_local = threading.local()
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+
+class _NullStage(object):
+    """ Stage context used when profiling is disabled.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_null_stage = _NullStage()
+
+
+def _call_stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _current(function):
+    if function is not None:
+        return function
+    stack = _call_stack()
+    return stack[-1] if stack else '<unknown>'
+
+
+class _Stage(object):
+    """ Time one stage of a profiled function.
+    """
+
+    def __init__(self, function, stage):
+        self.function = function
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = _timer()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = _timer() - self.start
+        for profiler in list(_profilers):
+            profiler._add_stage(self.function, self.stage, elapsed)
+        return False
+
+
+def _stage(stage, function=None):
+    """ Return a context manager that times a stage of the current profiled function.
+    """
+    if not _profilers:
+        return _null_stage
+    return _Stage(_current(function), stage)
+
+
+def _count(name, n=1, function=None):
+    """ Add to a count for the current profiled function.
+    """
+    if not _profilers:
+        return
+    function = _current(function)
+    for profiler in list(_profilers):
+        profiler._add_count(function, name, n)
+
+
+def _active():
+    """ Return True if any profiler is active, for counts that are expensive to compute.
+    """
+    return bool(_profilers)
+
+
+def _profiled(name):
+    """ Decorator that records the number of calls and total time of a function.
+    """
+
+    def decorator(func):
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _profilers:
+                return func(*args, **kwargs)
+
+            stack = _call_stack()
+            stack.append(name)
+            start = _timer()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = _timer() - start
+                stack.pop()
+                for profiler in list(_profilers):
+                    profiler._add_call(name, elapsed)
+
+        return wrapper
+
+    return decorator
+
+
+def _new_function():
+    return {'calls': 0, 'seconds': 0.0, 'stages': {}, 'counts': collections.defaultdict(int)}
+
+
+class Profiler(object):
+    """ Record per-stage timings and counts of the gretafun parsers.
+
+    Profiling starts when the profiler is entered as a context manager (or start() is called)
+    and stops when it is exited (or stop() is called). More than one profiler can be active at
+    once, for example a long lived profiler that collects metrics for a service and a short
+    lived one around a single call; each records every event.
+
+    Results accumulate across start/stop cycles until reset() is called.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def start(self):
+        """ Start recording.
+        """
+        if self not in _profilers:
+            _profilers.append(self)
+
+    def stop(self):
+        """ Stop recording.
+        """
+        if self in _profilers:
+            _profilers.remove(self)
+
+    def reset(self):
+        """ Discard everything recorded so far.
+        """
+        with self._lock:
+            self._functions = collections.defaultdict(_new_function)
+
+    def _add_call(self, function, elapsed):
+        with self._lock:
+            entry = self._functions[function]
+            entry['calls'] += 1
+            entry['seconds'] += elapsed
+
+    def _add_stage(self, function, stage, elapsed):
+        with self._lock:
+            stages = self._functions[function]['stages']
+            if stage not in stages:
+                stages[stage] = {'calls': 0, 'seconds': 0.0}
+            stages[stage]['calls'] += 1
+            stages[stage]['seconds'] += elapsed
+
+    def _add_count(self, function, name, n):
+        with self._lock:
+            self._functions[function]['counts'][name] += n
+
+    def as_dict(self):
+        """ Return everything recorded so far.
+
+        :returns: Dictionary keyed by function name of dictionaries with 'calls' and 'seconds'
+                  (total time in the function), 'stages' (dictionary keyed by stage name of
+                  {'calls': n, 'seconds': s} dictionaries), and 'counts' (dictionary of
+                  counts such as 'lines' and 'skipped_lines') keys
+
+        """
+
+        with self._lock:
+            return dict((function, {'calls': entry['calls'],
+                                    'seconds': entry['seconds'],
+                                    'stages': dict((stage, dict(value)) for stage, value
+                                                   in entry['stages'].items()),
+                                    'counts': dict(entry['counts'])})
+                        for function, entry in self._functions.items())
+
+    def to_prometheus(self, prefix='gretafun'):
+        """ Return everything recorded so far in the Prometheus text exposition format.
+
+        :param prefix: Prefix for the metric names
+
+        :returns: String of gretafun_calls_total, gretafun_seconds_total,
+                  gretafun_stage_calls_total, gretafun_stage_seconds_total, and
+                  gretafun_events_total counters labelled by function, stage, and event
+
+        """
+
+        functions = self.as_dict()
+
+        def label(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        metrics = [('calls_total', 'Number of calls of each profiled function',
+                    [('function="{}"'.format(label(function)), entry['calls'])
+                     for function, entry in sorted(functions.items())]),
+                   ('seconds_total', 'Time spent in each profiled function',
+                    [('function="{}"'.format(label(function)), entry['seconds'])
+                     for function, entry in sorted(functions.items())]),
+                   ('stage_calls_total', 'Number of times each stage was run',
+                    [('function="{}",stage="{}"'.format(label(function), label(stage)),
+                      value['calls'])
+                     for function, entry in sorted(functions.items())
+                     for stage, value in sorted(entry['stages'].items())]),
+                   ('stage_seconds_total', 'Time spent in each stage',
+                    [('function="{}",stage="{}"'.format(label(function), label(stage)),
+                      value['seconds'])
+                     for function, entry in sorted(functions.items())
+                     for stage, value in sorted(entry['stages'].items())]),
+                   ('events_total', 'Counts of lines, skipped lines, cache hits and misses',
+                    [('function="{}",event="{}"'.format(label(function), label(event)), value)
+                     for function, entry in sorted(functions.items())
+                     for event, value in sorted(entry['counts'].items())])]
+
+        lines = []
+        for name, description, samples in metrics:
+            name = '{}_{}'.format(prefix, name)
+            lines.append('# HELP {} {}'.format(name, description))
+            lines.append('# TYPE {} counter'.format(name))
+            for labels, value in samples:
+                value = repr(value) if isinstance(value, float) else str(value)
+                lines.append('{}{{{}}} {}'.format(name, labels, value))
+
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,152 @@
+""" Telemetry database (TDB) metadata providers.
+
+Limit summaries include the owner and description of each mnemonic. Metadata providers look
+these up for many mnemonics in a single batch, and memoize the results for the life of the
+process, and optionally in a JSON file on disk.
+
+The TdbMetadata provider uses the Ska telemetry database. The TableMetadata provider uses a
+user supplied table, and can stand in for the Ska environment where it is not available.
+
+"""
+
+import json
+import os
+
+__all__ = ['MetadataProvider', 'TdbMetadata', 'TableMetadata', 'default_metadata']
+
+
+class MetadataProvider(object):
+    """ Base class for memoizing mnemonic metadata lookups.
+
+    :param cachefile: Optional JSON file used to persist looked up metadata between processes
+
+    Subclasses implement _load(msids), which returns a dictionary of {'owner': owner,
+    'description': description} dictionaries for the mnemonics it knows about. Mnemonics that
+    are not found are reported with an owner and description of 'Not Known'.
+
+    """
+
+    unknown = {'owner': 'Not Known', 'description': 'Not Known'}
+
+    def __init__(self, cachefile=None):
+        self.cachefile = cachefile
+        self._memo = {}
+
+        if cachefile is not None and os.path.exists(cachefile):
+            try:
+                with open(cachefile, 'r') as fid:
+                    self._memo.update(json.load(fid))
+            except ValueError:
+                # Corrupt cache file, it will be rewritten on the next lookup
+                pass
+
+    def lookup(self, msids):
+        """ Return metadata for a collection of mnemonics.
+
+        :param msids: Iterable of mnemonic names
+
+        :returns: Dictionary keyed by mnemonic name of {'owner': owner, 'description':
+                  description} dictionaries
+
+        """
+
+        msids = set(msids)
+        missing = [msid for msid in msids if msid not in self._memo]
+
+        if missing:
+            found = self._load(missing)
+            for msid in missing:
+                self._memo[msid] = found.get(msid, self.unknown)
+            self._save()
+
+        return dict((msid, self._memo[msid]) for msid in msids)
+
+    def __getitem__(self, msid):
+        return self.lookup([msid])[msid]
+
+    def _load(self, msids):
+        raise NotImplementedError
+
+    def _save(self):
+        if self.cachefile is None:
+            return
+
+        tmpname = self.cachefile + '.tmp{}'.format(os.getpid())
+        try:
+            with open(tmpname, 'w') as fid:
+                json.dump(self._memo, fid)
+            os.rename(tmpname, self.cachefile)
+        except (IOError, OSError):
+            pass
+
+
+class TdbMetadata(MetadataProvider):
+    """ Mnemonic metadata from the Ska telemetry database.
+
+    :param cachefile: Optional JSON file used to persist looked up metadata between processes
+
+    The telemetry database is read directly using Ska.tdb, so no engineering archive data
+    needs to be fetched. If Ska.tdb is not available, each mnemonic is looked up through a
+    short engineering archive query instead, and if neither is available the owner and
+    description of every mnemonic are reported as unknown.
+
+    """
+
+    def _load(self, msids):
+        try:
+            from Ska.tdb import msids as tdb_msids
+        except ImportError:
+            return self._load_from_archive(msids)
+
+        found = {}
+        for msid in msids:
+            try:
+                tdb = tdb_msids[msid]
+            except (KeyError, ValueError):
+                continue
+            found[msid] = {'owner': tdb.owner_id, 'description': tdb.technical_name}
+
+        return found
+
+    def _load_from_archive(self, msids):
+        try:
+            import Ska.engarchive.fetch_eng as fetch_eng
+        except ImportError:
+            # Without the Ska environment every mnemonic is reported as unknown
+            return {}
+
+        found = {}
+        for msid in msids:
+            try:
+                tdb = fetch_eng.Msid(msid, start='2001:001:00:00:00', stop='2001:001:00:05:00').tdb
+            except (KeyError, ValueError):
+                continue
+            found[msid] = {'owner': tdb.owner_id, 'description': tdb.technical_name}
+
+        return found
+
+
+class TableMetadata(MetadataProvider):
+    """ Mnemonic metadata from a user supplied table.
+
+    :param table: Dictionary keyed by mnemonic name, with values that are either (owner,
+                  description) tuples or {'owner': owner, 'description': description}
+                  dictionaries
+    :param cachefile: Optional JSON file used to persist looked up metadata between processes
+
+    """
+
+    def __init__(self, table, cachefile=None):
+        super(TableMetadata, self).__init__(cachefile)
+        self.table = {}
+        for msid, value in table.items():
+            if not isinstance(value, dict):
+                value = {'owner': value[0], 'description': value[1]}
+            self.table[msid] = value
+
+    def _load(self, msids):
+        return dict((msid, self.table[msid]) for msid in msids if msid in self.table)
+
+
+# Memoized for the life of the process
+default_metadata = TdbMetadata()
@@ -0,0 +1,50 @@
+""" Check that importing gretafun stays fast and does not load the Ska stack.
+
+Each check imports gretafun in a fresh interpreter, so modules already loaded by the test
+runner do not hide a slow or heavy import.
+
+"""
+
+import os
+import subprocess
+import sys
+
+# Seconds allowed for "import gretafun" once numpy is already imported
+IMPORT_BUDGET = 0.5
+
+_script = """
+import sys
+import time
+import numpy
+timer = getattr(time, 'perf_counter', time.time)
+start = timer()
+import gretafun
+elapsed = timer() - start
+heavy = sorted(name for name in sys.modules
+               if name.split('.')[0] in ('Chandra', 'Ska', 'matplotlib', 'astropy'))
+print(repr(elapsed))
+print(','.join(heavy))
+"""
+
+
+def _import_gretafun():
+    """ Import gretafun in a new interpreter, return the import time and heavy modules loaded.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([root] + [path for path in
+                                                  [env.get('PYTHONPATH')] if path])
+    output = subprocess.check_output([sys.executable, '-c', _script], env=env)
+    elapsed, heavy = output.decode('ascii').splitlines()[-2:]
+    return float(elapsed), [name for name in heavy.split(',') if name]
+
+
+def test_import_does_not_load_ska():
+    elapsed, heavy = _import_gretafun()
+    assert heavy == []
+
+
+def test_import_time():
+    # Best of three, to allow for a cold file system cache on the first run
+    elapsed = min(_import_gretafun()[0] for _ in range(3))
+    assert elapsed < IMPORT_BUDGET, 'import gretafun took {:.3f} s'.format(elapsed)
@@ -0,0 +1,84 @@
+""" Check that merging partial limit file results does not depend on the order of the files.
+
+A synthetic limit file is processed in a single pass, and also split into consecutive pieces
+that are processed separately and merged, with the pieces given in shuffled orders. The merged
+results must equal the single pass result.
+
+"""
+
+import copy
+import functools
+import os
+import random
+
+import pytest
+
+pytest.importorskip('Chandra.Time')
+
+from gretafun.benchmark import generate_limfile
+from gretafun.gretaparse import process_limits_file
+from gretafun.limlog import LimitLog, process_limits_files, _summarize_file
+from gretafun.tdbmeta import TableMetadata
+
+NLINES = 6000
+NPIECES = 5
+
+
+def _split_limfile(tmpdir):
+    """ Write a synthetic limit file and the same lines split into consecutive pieces.
+
+    :returns: Tuple of the full file name and the list of piece file names, in time order
+
+    """
+
+    filename = os.path.join(str(tmpdir), 'limfile.txt')
+    generate_limfile(filename, nlines=NLINES, nmsids=20, seed=1)
+    with open(filename, 'r') as fid:
+        lines = fid.readlines()
+
+    # Uneven piece sizes, so some mnemonics span several pieces
+    edges = sorted(random.Random(2).sample(range(1, len(lines)), NPIECES - 1))
+    edges = [0] + edges + [len(lines)]
+    pieces = []
+    for n, (start, stop) in enumerate(zip(edges[:-1], edges[1:])):
+        piece = os.path.join(str(tmpdir), 'limfile{}.txt'.format(n))
+        with open(piece, 'w') as fid:
+            fid.writelines(lines[start:stop])
+        pieces.append(piece)
+
+    return filename, pieces
+
+
+def test_merged_files_match_single_pass(tmpdir):
+    filename, pieces = _split_limfile(tmpdir)
+    metadata = TableMetadata({})
+
+    for compact in (False, True):
+        expected = process_limits_file(filename, metadata=metadata, compact=compact)
+        rng = random.Random(3)
+        for _ in range(3):
+            rng.shuffle(pieces)
+            result = process_limits_files(pieces, processes=1, metadata=metadata,
+                                          compact=compact)
+            assert result == expected
+
+
+def test_merge_commutative_and_associative(tmpdir):
+    filename, pieces = _split_limfile(tmpdir)
+    expected = process_limits_file(filename, metadata=TableMetadata({}))
+
+    partials = [_summarize_file(piece) for piece in pieces]
+    originals = [copy.deepcopy(partial.limlog) for partial in partials]
+
+    # Either of two adjacent results can be passed first
+    for early, late in zip(partials[:-1], partials[1:]):
+        assert early.merge(late).limlog == late.merge(early).limlog
+
+    # Adjacent results can be grouped in any way
+    for split in range(1, len(partials)):
+        left = functools.reduce(LimitLog.merge, partials[:split], LimitLog())
+        right = functools.reduce(LimitLog.merge, partials[split:], LimitLog())
+        assert right.merge(left).limlog == expected
+
+    # Merging does not modify the partial results
+    assert [partial.limlog for partial in partials] == originals